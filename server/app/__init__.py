@@ -4,6 +4,9 @@ from flask_socketio import SocketIO
 from flask_cors import CORS
 
 
+# 'threading' for development; nanocas.py serves on 'eventlet' (or 'gevent') in production mode
+ASYNC_MODE = os.getenv('NANOCAS_ASYNC_MODE', 'threading')
+
 socketio = SocketIO()
 
 def create_app(debug=True):
@@ -17,6 +20,6 @@ def create_app(debug=True):
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
-    socketio.init_app(app, cors_allowed_origins='*')
+    socketio.init_app(app, cors_allowed_origins='*', async_mode=ASYNC_MODE)
 
     return app
\ No newline at end of file
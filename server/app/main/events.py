@@ -1,17 +1,23 @@
 from flask import url_for, session
-from flask_socketio import emit, send
+from flask_socketio import emit, join_room, leave_room, send
 from .. import socketio
 
-from threading import Thread, Event
+from threading import Thread, Event, Lock
 
 # for download_database
 import os, shutil, subprocess
-from time import sleep
+from time import monotonic, sleep
 
 # for run_fastq_watcher
 from .utils.FileHandler import FileHandler
-from .utils.tasks import int_download_database
+from .utils.concurrency import run_blocking
+from .utils.executor import TERMINAL_STATES, download_status, get_executor, record_download_task
+from .utils.AlertRuleIndex import release_rule_index
+from .utils.CoverageBroadcaster import coverage_room, get_broadcaster, release_broadcaster
+from .utils.CoverageTimeline import get_timeline, release_timeline
+from .utils.ProjectRegistry import get_projects
 from .utils import LinuxNotification
+from .utils.NotificationDispatcher import get_dispatcher
 
 # for run_fasq_watcher
 from watchdog.observers import Observer
@@ -23,8 +29,16 @@ import logging
 
 logger = logging.getLogger('nanocas')
 
-# Global dictionary to store observers by project ID
+# Global dictionaries to store observers and their handlers by project ID
 observers = {}
+handlers = {}
+# Projects whose database build progress is being pushed to clients
+download_watchers = set()
+download_watchers_lock = Lock()
+# Seconds between checks of a database build's progress
+DOWNLOAD_POLL_INTERVAL = float(os.getenv('NANOCAS_DOWNLOAD_POLL_INTERVAL', 0.5))
+# Seconds a build may stay PENDING before it is reported as UNKNOWN (Celery can't tell queued from lost jobs)
+DOWNLOAD_PENDING_TIMEOUT = float(os.getenv('NANOCAS_DOWNLOAD_PENDING_TIMEOUT', 900))
 
 
 # HELPER FUNCTIONS
@@ -62,18 +76,13 @@ def remove_analysis(data):
 
     if os.path.exists(nanocas_location):
         # Delete the analysis directory
-        shutil.rmtree(nanocas_location)
-
-        # Update a cache file (if applicable)
-        cache_path = os.path.join(os.path.expanduser('~'), '.nanocas/.cache')
-        if os.path.exists(cache_path):
-            with open(cache_path, 'r+') as cache_fs:
-                lines = cache_fs.readlines()
-                cache_fs.seek(0)
-                for line in lines:
-                    if project_id not in line:
-                        cache_fs.write(line)
-                cache_fs.truncate()
+        release_broadcaster(project_id)
+        release_timeline(nanocas_location)
+        release_rule_index(nanocas_location)
+        run_blocking(shutil.rmtree, nanocas_location)
+
+        # Forget the project in the registry
+        get_projects(os.path.join(os.path.expanduser('~'), '.nanocas')).remove(project_id)
 
         # Notify the client of success
         emit('analysis_removed', {'success': True, 'message': 'Analysis removed successfully'})
@@ -81,6 +90,33 @@ def remove_analysis(data):
         # Notify the client of failure
         emit('analysis_removed', {'success': False, 'message': 'Analysis not found'})
 
+@socketio.on('join_project')
+def join_project(data):
+    """Subscribe to a project's coverage updates.
+
+    A client that sends the epoch and seq of the last update it saw gets
+    only the updates it missed; otherwise, or if those are no longer held,
+    it gets a full coverage_snapshot.
+    """
+    project_id = data['projectId']
+    nanocas_location = os.path.join(os.path.expanduser('~'), '.nanocas/', project_id)
+    broadcaster = get_broadcaster(project_id)
+    if os.path.exists(os.path.join(nanocas_location, 'coverage.db')):
+        broadcaster.seed(*run_blocking(get_timeline(nanocas_location).latest))
+    join_room(coverage_room(project_id))
+    missed = None
+    if data.get('lastSeq') is not None:
+        missed = broadcaster.resume(data.get('epoch'), int(data['lastSeq']))
+    if missed is None:
+        emit('coverage_snapshot', broadcaster.snapshot())
+        return
+    for update in missed:
+        emit('coverage_update', update)
+
+@socketio.on('leave_project')
+def leave_project(data):
+    leave_room(coverage_room(data['projectId']))
+
 @socketio.on('start_fastq_file_listener')
 def start_fastq_file_listener(data):
     project_id = data['projectId']
@@ -88,18 +124,26 @@ def start_fastq_file_listener(data):
     minion_location = data['minion_location']
 
     if project_id not in observers:
+        event_handler = None
         try:
-            event_handler = FileHandler(nanocas_location)
-            # Start processing existing files in a separate thread
-            thread = Thread(target=event_handler.process_existing_files, args=(minion_location,))
-            thread.start()
+            # Rebuilding coverage from the stored shards can take a while
+            event_handler = run_blocking(FileHandler, nanocas_location)
+            # Queue existing files first so they lead the same stream as live events
+            run_blocking(event_handler.process_existing_files, minion_location)
             observer = Observer()
             observer.schedule(event_handler, path=minion_location, recursive=False)
             observer.start()
             observers[project_id] = observer
+            handlers[project_id] = event_handler
             emit('fastq_file_listener_started', {'projectId': project_id})
             logger.debug(f"Started file listener for project {project_id}")
         except Exception as e:
+            # Stop the handler's threads so a retry doesn't share its shard store
+            if event_handler is not None:
+                try:
+                    run_blocking(event_handler.close)
+                except Exception as close_error:
+                    logger.error(f"Error closing file handler for project {project_id}: {close_error}")
             emit('fastq_file_listener_error', {'projectId': project_id, 'error': str(e)})
             logger.error(f"Error starting file listener for project {project_id}: {e}")
     else:
@@ -113,8 +157,9 @@ def stop_fastq_file_listener(data):
         try:
             observer = observers[project_id]
             observer.stop()
-            observer.join()
+            run_blocking(observer.join)
             del observers[project_id]
+            run_blocking(handlers.pop(project_id).close)
             emit('fastq_file_listener_stopped', {'projectId': project_id})
             logger.debug(f"Stopped file listener for project {project_id}")
         except Exception as e:
@@ -130,30 +175,42 @@ def check_fastq_file_listener(data):
     is_running = project_id in observers
     emit('fastq_file_listener_status', {'projectId': project_id, 'is_running': is_running})
 
-def on_raw_message(message):
-    status = message['status']
-    if status == "PROGRESS":
-
-        percent_done = message['result']['percent-done']
-        status_message = message['result']['message']
-        project_id = message['result']['project_id']
-
-        emit(
-            'download_database_status',
-            {'percent_done': percent_done, 'status_message': status_message}
-        )
-
-        if percent_done == 100:
-            minion = message['result']['minion']
-            nanocas_location = message['result']['nanocas_location']
+def download_room(project_id):
+    return f"download:{project_id}"
 
-            logger.debug("Debug: Starting the MinION Listener")
-            # start_fastq_file_listener(nanocas_location, minion)
-
-    if status == "SUCCESS":
-        minion = message['result']['minion']
-        nanocas_location = message['result']['nanocas_location']
-        logger.debug(f"Debug: MinION Location: {minion}, nanocas Location: {nanocas_location}")
+def watch_download(project_id, nanocas_location, last_status=None):
+    """Push a project's database build progress to its room until the build finishes."""
+    pending_since = None
+    try:
+        while True:
+            status = download_status(nanocas_location)
+            if status is None:
+                return
+            if status['state'] != 'PENDING':
+                pending_since = None
+            elif pending_since is None:
+                pending_since = monotonic()
+            elif monotonic() - pending_since >= DOWNLOAD_PENDING_TIMEOUT:
+                status = dict(status, state='UNKNOWN',
+                              status_message=f"No worker picked up the build in {DOWNLOAD_PENDING_TIMEOUT:.0f} seconds.")
+            if status != last_status:
+                socketio.emit('download_database_status', dict(status, project_id=project_id),
+                              to=download_room(project_id))
+                last_status = status
+            if status['state'] in TERMINAL_STATES:
+                logger.debug(f"Debug: Database build for {project_id} finished: {status['state']}")
+                return
+            socketio.sleep(DOWNLOAD_POLL_INTERVAL)
+    finally:
+        with download_watchers_lock:
+            download_watchers.discard(project_id)
+
+def start_download_watcher(project_id, nanocas_location, last_status=None):
+    with download_watchers_lock:
+        if project_id in download_watchers:
+            return
+        download_watchers.add(project_id)
+    socketio.start_background_task(watch_download, project_id, nanocas_location, last_status)
 
 
 @socketio.on('download_database', namespace="/")
@@ -167,7 +224,10 @@ def download_database(dbinfo):
     if not os.path.exists(nanocas_location):
         os.makedirs(nanocas_location)
     else:
-        shutil.rmtree(nanocas_location)
+        release_broadcaster(project_id)
+        release_timeline(nanocas_location)
+        release_rule_index(nanocas_location)
+        run_blocking(shutil.rmtree, nanocas_location)
         os.makedirs(nanocas_location)
 
     queries = dbinfo["queries"]
@@ -178,19 +238,36 @@ def download_database(dbinfo):
     # Send notification only if device is specified and not empty
     if device:
         alert_str = f"You can find the nanocas alert page for {project_id} at http://localhost:3000/analysis/{project_id}"
-        LinuxNotification.send_notification(device, alert_str, severity=1)
+        get_dispatcher().submit(f"MinKNOW notification to {device}",
+                                lambda: LinuxNotification.send_notification(device, alert_str, severity=1))
 
     # Rest of the function remains unchanged
     os.umask(0)
     os.makedirs(os.path.join(nanocas_location, 'database'), mode=0o777, exist_ok=True)
     os.umask(0)
     os.makedirs(nanocas_location + 'minimap2/runs', mode=0o777, exist_ok=True)
-    res = int_download_database.apply_async(args=[dbinfo, nanocas_location, queries])
-    res.get(on_message=on_raw_message, propagate=False)
-    
-    
-    
-   
+    # The build runs on the executor; progress reaches the requesting client through its room
+    job = get_executor().submit('download_database', dbinfo, nanocas_location, queries)
+    record_download_task(nanocas_location, job.id)
+    join_room(download_room(project_id))
+    start_download_watcher(project_id, nanocas_location)
+    return {'project_id': project_id, 'task_id': job.id}
+
+
+@socketio.on('watch_download_database')
+def watch_download_database(data):
+    """Resume watching a project's database build, e.g. after reconnecting."""
+    project_id = data['projectId']
+    nanocas_location = os.path.join(os.path.expanduser('~'), '.nanocas/' + project_id + '/')
+    status = download_status(nanocas_location)
+    if status is None:
+        emit('download_database_status', {'project_id': project_id, 'state': 'UNKNOWN',
+                                           'percent_done': 0, 'status_message': "No database build found"})
+        return
+    join_room(download_room(project_id))
+    emit('download_database_status', dict(status, project_id=project_id))
+    if status['state'] not in TERMINAL_STATES:
+        start_download_watcher(project_id, nanocas_location, status)
 
 
 # LOGGER HOOKS
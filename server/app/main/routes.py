@@ -11,11 +11,25 @@ import glob
 from flask import session, render_template, request, abort, jsonify
 from . import main
 from .utils import LinuxNotification
+from .utils.AlertRuleIndex import get_rule_index, release_rule_index
+from .utils.CoverageBroadcaster import release_broadcaster
+from .utils.CoverageTimeline import RESOLUTIONS, get_timeline, release_timeline, to_epoch
+from .utils.LinuxNotification import get_registry
+from .utils.NotificationDispatcher import get_dispatcher
+from .utils.ProjectRegistry import get_projects
+from .utils.concurrency import run_blocking
+from .utils.downsample import lttb
+from .utils.http_cache import compress_response, conditional_response
+from .utils.executor import download_status
 
 logger = logging.getLogger('nanocas')
 
 NANOCAS_DIR = os.path.join(os.path.expanduser('~'), '.nanocas')
-CACHE_PATH = os.path.join(os.path.expanduser('~'), '.nanocas/.cache') # Add to CONFIG
+
+# database directory -> (mtime_ns, is_ready), so status polls don't glob every time
+_database_status = {}
+
+main.after_request(compress_response)
 
 @main.route('/version', methods=['GET'])
 def version():
@@ -26,10 +40,31 @@ def check_database_status():
     project_id = request.args.get('projectId')
     if not project_id:
         return jsonify({'error': 'projectId is required'}), 400
-    nanocas_path = os.path.join(NANOCAS_DIR, project_id)
-    mmi_files = glob.glob(os.path.join(nanocas_path, 'database', '*.mmi'))
-    is_ready = len(mmi_files) > 0
-    return jsonify({'is_ready': is_ready})
+    database_dir = os.path.join(NANOCAS_DIR, project_id, 'database')
+
+    def build():
+        try:
+            mtime = os.stat(database_dir).st_mtime_ns
+        except FileNotFoundError:
+            return jsonify({'is_ready': False})
+        cached = _database_status.get(database_dir)
+        if cached is None or cached[0] != mtime:
+            mmi_files = glob.glob(os.path.join(database_dir, '*.mmi'))
+            cached = _database_status[database_dir] = (mtime, len(mmi_files) > 0)
+        return jsonify({'is_ready': cached[1]})
+
+    return conditional_response([database_dir], build)
+
+@main.route('/download_database_status', methods=['GET'])
+def get_download_database_status():
+    """Progress of a project's database build, for clients that reconnect while it runs."""
+    project_id = request.args.get('projectId')
+    if not project_id:
+        return jsonify({'error': 'projectId is required'}), 400
+    status = download_status(os.path.join(NANOCAS_DIR, project_id))
+    if status is None:
+        return jsonify({'error': 'No database build found'}), 404
+    return jsonify(dict(status, project_id=project_id))
 
 @main.route('/get_timeline_info', methods=["GET"])
 def get_timeline_info():
@@ -48,16 +83,11 @@ def get_timeline_info():
     else:
         return jsonify({'message': 'Timeline info not found'}), 404
 
-def get_nanocas_cache_path():
-    return os.path.join(NANOCAS_DIR, '.cache')
-
 def get_analysis_timeline_path():
     return os.path.join(NANOCAS_DIR, 'analysis.timeline')
 
-def write_to_cache(uid, minION_location, uid_dir):
-    entry = f"{uid}\t{minION_location}\t{uid_dir}\n"
-    with open(get_nanocas_cache_path(), 'a+') as cache_fs:
-        cache_fs.write(entry)
+def project_registry():
+    return get_projects(NANOCAS_DIR)
 
 @main.route('/get_uid', methods=["POST"])
 def get_uid():
@@ -65,40 +95,31 @@ def get_uid():
     if not minION_location:
         abort(400, description="minION location not provided.")
 
-    cache_path = get_nanocas_cache_path()
-    uid = str(uuid.uuid4())
-
-    if os.path.exists(cache_path):
-        with open(cache_path, 'r') as cache_fs:
-            lines = cache_fs.readlines()
-            for line in lines:
-                parts = line.strip().split('\t')
-                if len(parts) >= 2 and parts[1] == minION_location:
-                    return jsonify({'uid': parts[0]})  # Return existing UID
-
-    uid_dir = os.path.join(NANOCAS_DIR, uid)
-    write_to_cache(uid, minION_location, uid_dir)
+    # Returns the existing UID if this MinION location already has a project
+    uid = project_registry().register(minION_location, NANOCAS_DIR)
 
     return jsonify({'uid': uid})
 
 @main.route('/get_all_analyses', methods=['GET'])
 def get_all_analyses():
     if request.method == "GET":
-        data = []
-        validate_cache()
-        with open(CACHE_PATH, 'r') as cache_fs:
-            for line in cache_fs:
-                [projectId, minion_dir, NANOCAS_DIR] = line.split("\t")
+        registry = project_registry()
+
+        def build():
+            data = []
+            for project in registry.all():
                 data.append({
-                    "id"        : projectId,
-                    "minion_dir": minion_dir,
-                    "NANOCAS_DIR" : NANOCAS_DIR
+                    "id"        : project['id'],
+                    "minion_dir": project['minion_dir'],
+                    "NANOCAS_DIR" : project['nanocas_dir']
                 })
 
-        return json.dumps({
-            'status': 200,
-            'data'  : data
-        })
+            return json.dumps({
+                'status': 200,
+                'data'  : data
+            })
+
+        return conditional_response(registry.paths, build)
 
 @main.route('/delete_analyses', methods=['POST'])
 def delete_analyses():
@@ -107,21 +128,15 @@ def delete_analyses():
 
     # Get Post Data
     uid = request.form['uid']
-    found = False
-    with open(CACHE_PATH, 'r+') as cache_fs:
-        filtered_lines = []
-        for line in cache_fs:
-            if uid not in line:
-                filtered_lines.append(line)
-            else:
-                logger.debug(f"Debug: Removed id {uid} from cache")
-                found = True
-        cache_fs.seek(0)
-        cache_fs.write("".join(filtered_lines))
-        cache_fs.truncate()
+    found = project_registry().remove(uid)
+    if found:
+        logger.debug(f"Debug: Removed id {uid} from cache")
 
     # delete the nanocas directory for the uid
     uid_dir = os.path.join(os.path.expanduser('~'), '.nanocas/' + uid) # Add to CONFIG
+    release_broadcaster(uid)
+    release_timeline(uid_dir)
+    release_rule_index(uid_dir)
     if os.path.exists(uid_dir):
         subprocess.call(['rm', '-rf', uid_dir])
     
@@ -134,35 +149,28 @@ def delete_analyses():
 def get_analysis_info():
     if request.method == 'GET':
         uid = request.args.get('uid')
+        registry = project_registry()
+        alert_cfg_file = os.path.join(NANOCAS_DIR, str(uid), 'alertinfo.cfg')
+        return conditional_response(registry.paths + [alert_cfg_file], lambda: build_analysis_info(uid))
 
-        # get minion and nanocas location
-        nanocas_path = ""
-        validate_cache()
-        with open(CACHE_PATH, 'r') as cache_fs:
-            found = False
-            for line in cache_fs:
-                entry = line.split("\t")
-                entry_id = entry[0]
-                entry_nanocas_path = entry[2].rstrip()
-                if uid == entry_id:
-                    nanocas_path = entry_nanocas_path
-                    found = True
-                    break
-
-        if not found:
-            return json.dumps({'status': 404, 'message': "Couldn't find the analysis data with UID: " + str(uid)})
-        else:
-
-            alert_cfg_file = os.path.join(nanocas_path, 'alertinfo.cfg')
-            alert_cfg_obj = json.load(open(alert_cfg_file))
+    else:
+        return "Unexpected request method. Expected a GET request."
 
-            return json.dumps({
-                'status': 200,
-                'data'  : alert_cfg_obj
-            })
+def build_analysis_info(uid):
+    """Alert configuration of an analysis, looked up through the project registry."""
+    project = project_registry().get(uid)
 
+    if project is None:
+        return json.dumps({'status': 404, 'message': "Couldn't find the analysis data with UID: " + str(uid)})
     else:
-        return "Unexpected request method. Expected a GET request."
+
+        alert_cfg_file = os.path.join(project['nanocas_dir'], 'alertinfo.cfg')
+        alert_cfg_obj = json.load(open(alert_cfg_file))
+
+        return json.dumps({
+            'status': 200,
+            'data'  : alert_cfg_obj
+        })
 
 @main.route('/analysis', methods=['GET'])
 def analysis():
@@ -247,58 +255,88 @@ def validate_locations():
 
 @main.route('/get_coverage', methods=['GET'])
 def get_coverage():
+    """Coverage history of a project.
+
+    Optional query parameters: resolution (raw, 1min, 10min), since (return
+    only rows after this timestamp), references (comma-separated names or
+    headers) and max_points (LTTB-downsample each reference's series by
+    depth). Without them the full raw history is returned.
+    """
     project_id = request.args.get('projectId')
-    coverage_file = os.path.join(NANOCAS_DIR, project_id, 'coverage.csv')
-    if not os.path.exists(coverage_file):
+    project_dir = os.path.join(NANOCAS_DIR, project_id)
+    if not any(os.path.exists(os.path.join(project_dir, f)) for f in ('coverage.db', 'coverage.csv')):
         return jsonify({'error': 'Coverage file not found'}), 404
-
-    alert_cfg_file = os.path.join(NANOCAS_DIR, project_id, 'alertinfo.cfg')
+    resolution = request.args.get('resolution', 'raw')
+    if resolution not in RESOLUTIONS:
+        return jsonify({'error': f"resolution must be one of {', '.join(RESOLUTIONS)}"}), 400
+    since = request.args.get('since')
+    max_points = request.args.get('max_points')
     try:
-        with open(alert_cfg_file, 'r') as f:
-            alert_cfg = json.load(f)
-        ref_to_name = {q['header']: q['name'] for q in alert_cfg['queries']}
-    except Exception as e:
-        logger.error(f"Error loading alert config: {e}")
-        ref_to_name = {}
-
-    try:
-        with open(coverage_file, 'r') as f:
-            lines = f.readlines()[1:]  # Skip header
-        data = []
-        for line in lines:
-            timestamp, ref, depth, breadth, read_count = line.strip().split(',')
-            name = ref_to_name.get(ref, ref)  # Map reference to alert sequence name
-            data.append({
-                'timestamp': timestamp,
-                'reference': name,
-                'depth': float(depth),
-                'breadth': float(breadth),
-                'read_count': int(read_count)
-            })
-        return jsonify(data)
-    except Exception as e:
-        logger.error(f"Error reading coverage file: {e}")
-        return jsonify({'error': 'Error processing coverage data'}), 500
+        max_points = int(max_points) if max_points is not None else None
+        if max_points is not None and max_points < 1:
+            raise ValueError(f"max_points must be at least 1, got {max_points}")
+        if since is not None:
+            to_epoch(since)
+    except ValueError:
+        return jsonify({'error': 'Invalid since or max_points'}), 400
+
+    # Both may read or migrate files on disk the first time, so keep them off the event loop
+    rules = run_blocking(get_rule_index, project_dir)
+    ref_to_name = rules.names
+
+    references = None
+    if request.args.get('references'):
+        name_to_ref = {name: ref for ref, name in ref_to_name.items()}
+        references = [name_to_ref.get(r, r) for r in request.args['references'].split(',')]
+
+    # Open the timeline first so the version below reflects its files
+    timeline = run_blocking(get_timeline, project_dir)
+
+    def build():
+        try:
+            data = run_blocking(timeline.query, resolution, since=since, references=references)
+            if max_points is not None:
+                data = run_blocking(downsample_coverage, data, max_points)
+            for entry in data:
+                entry['reference'] = ref_to_name.get(entry['reference'], entry['reference'])  # Map reference to alert sequence name
+            return jsonify(data)
+        except Exception as e:
+            logger.error(f"Error reading coverage timeline: {e}")
+            return jsonify({'error': 'Error processing coverage data'}), 500
+
+    coverage_db = os.path.join(project_dir, 'coverage.db')
+    return conditional_response([coverage_db, coverage_db + '-wal', rules.config_path], build,
+                                extra=request.query_string.decode())
+
+def downsample_coverage(data, max_points):
+    """Downsample each reference's series to at most max_points rows, keeping time order."""
+    series = {}
+    for entry in data:
+        series.setdefault(entry['reference'], []).append(entry)
+    kept = []
+    for entries in series.values():
+        x = [to_epoch(e['timestamp']) for e in entries]
+        y = [e['depth'] for e in entries]
+        kept.extend(entries[i] for i in lttb(x, y, max_points))
+    kept.sort(key=lambda e: (e['timestamp'], e['reference']))
+    return kept
 
 @main.route('/index_devices', methods=['GET'])
 def index_devices():
     if request.method == 'GET':
         devices = []
-        indexed_devices = LinuxNotification.index_devices()
+        # MinKNOW is queried over gRPC, which doesn't cooperate with the event loop
+        indexed_devices = run_blocking(LinuxNotification.index_devices)
         if indexed_devices:
             for device in indexed_devices:
                 if device.state not in ["STATE_HARDWARE_REMOVED", "STATE_HARDWARE_ERROR", "STATE_SOFTWARE_ERROR"]:
                     devices.append(device.name)
-                    LinuxNotification.send_notification(device.name, "Device discovered by nanocas", severity=1)
+        # Greet each device once, in the background rather than on every page load
+        dispatcher = get_dispatcher()
+        for name in get_registry().newly_seen(devices):
+            dispatcher.submit(f"MinKNOW notification to {name}", lambda name=name: LinuxNotification.send_notification(
+                name, "Device discovered by nanocas", severity=1))
         # Always return a valid JSON response
         return json.dumps(devices)
     # Explicitly return an empty list if not GET (should not happen)
     return json.dumps([])
-    
-def validate_cache(cache_path=CACHE_PATH):
-    if not os.path.isfile(cache_path):
-        if not os.path.isdir(NANOCAS_DIR):
-            os.mkdir(NANOCAS_DIR)
-        open(CACHE_PATH, 'a').close()
-        logger.warning(f"No cache found! Generated empty cache file...")
-    pass
\ No newline at end of file
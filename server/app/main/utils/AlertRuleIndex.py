@@ -0,0 +1,92 @@
+import json
+import logging
+import os
+from threading import Lock
+
+logger = logging.getLogger('nanocas')
+
+_indexes = {}
+_indexes_lock = Lock()
+
+
+class AlertRuleIndex:
+    """Compiled view of a project's alertinfo.cfg, keyed by reference header.
+
+    The file is parsed once and re-parsed by refresh() only when its mtime or
+    size changes, so lookups during a batch never touch the disk.
+    """
+
+    def __init__(self, config_path: str):
+        self.config_path = config_path
+        self.lock = Lock()
+        self.version = None
+        self.config = {}
+        self.rules = {}
+        self.names = {}
+        self.thresholds = {}
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Reload the config if it changed on disk. Returns True if it was reloaded."""
+        try:
+            stat = os.stat(self.config_path)
+        except FileNotFoundError:
+            return False
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if version == self.version:
+                return False
+            try:
+                with open(self.config_path, 'r') as f:
+                    config = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Error loading alert config {self.config_path}: {e}")
+                return False
+            rules = {}
+            for query in config.get("queries", []):
+                header = query.get("header", "")
+                if header:
+                    rules.setdefault(header, []).append(query)
+            # Assign whole dicts so readers never see a half-built index
+            self.config = config
+            self.rules = rules
+            self.names = {header: queries[-1].get('name', header) for header, queries in rules.items()}
+            self.thresholds = {header: [float(q.get("threshold", 0)) for q in queries]
+                               for header, queries in rules.items()}
+            self.version = version
+        logger.debug(f"Loaded {len(rules)} alert rules from {self.config_path}")
+        return True
+
+    def rules_for(self, ref: str) -> list:
+        return self.rules.get(ref, [])
+
+    def thresholds_for(self, ref: str) -> list:
+        return self.thresholds.get(ref, [])
+
+    def name_for(self, ref: str) -> str:
+        return self.names.get(ref, ref)
+
+    @property
+    def device(self) -> str:
+        return self.config.get("device", "")
+
+    @property
+    def alert_notif_config(self) -> dict:
+        return self.config.get("alertNotifConfig", {})
+
+
+def get_rule_index(app_loc: str) -> AlertRuleIndex:
+    """Shared, refreshed rule index for a project directory."""
+    key = os.path.normpath(app_loc)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = AlertRuleIndex(os.path.join(key, 'alertinfo.cfg'))
+            return index
+    index.refresh()
+    return index
+
+
+def release_rule_index(app_loc: str):
+    with _indexes_lock:
+        _indexes.pop(os.path.normpath(app_loc), None)
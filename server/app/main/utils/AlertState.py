@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+logger = logging.getLogger('nanocas')
+
+
+class AlertState:
+    """Persisted, edge-triggered alert state of a project (alert_state.json).
+
+    Each query on a reference fires once when depth first reaches its
+    threshold, and again only for each escalation level it reaches
+    afterwards. A query may list escalation multipliers of its threshold,
+    e.g. "escalation": [2, 5] alerts again at 2x and 5x. Coverage only grows,
+    so a lower depth passed in later (a caller behind the worker that fired)
+    changes nothing; the query is re-armed only when its threshold or
+    escalations are edited.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = Lock()
+        self.state = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.state = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Error loading alert state {self.path}, starting re-armed: {e}")
+
+    @staticmethod
+    def key(ref: str, query: dict) -> str:
+        return f"{ref}\t{query.get('name', '')}"
+
+    def evaluate(self, ref: str, query: dict, depth: float) -> int | None:
+        """Return the level to alert at (0 = threshold, 1+ = escalations), or None if nothing new fired."""
+        threshold = float(query.get("threshold", 0))
+        levels = [threshold] + [threshold * float(m) for m in query.get("escalation", [])]
+        reached = -1
+        for i, level_threshold in enumerate(levels):
+            if depth >= level_threshold:
+                reached = i
+        # The rule the entry was fired under; entries saved before it was recorded keep the current one
+        rule = [threshold, [float(m) for m in query.get("escalation", [])]]
+        key = self.key(ref, query)
+        with self.lock:
+            entry = self.state.get(key, {"level": -1, "rule": rule})
+            if entry.get("rule", rule) != rule:
+                logger.debug(f"Re-armed alert for {key}: its threshold changed")
+                entry = {"level": -1, "rule": rule}
+                self.state[key] = entry
+                self._save()
+            if reached <= entry["level"]:
+                return None
+            self.state[key] = {"level": reached, "rule": rule, "depth": depth, "fired_at": time.time()}
+            self._save()
+        return reached
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {key: dict(entry) for key, entry in self.state.items()}
+
+    def restore(self, state: dict):
+        """Take over state from a checkpoint, e.g. when alert_state.json was lost."""
+        with self.lock:
+            self.state = {key: dict(entry) for key, entry in state.items()}
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,201 @@
+import heapq
+import logging
+import os
+import re
+import shutil
+from threading import Event, Lock, Thread
+
+import pysam
+
+logger = logging.getLogger('nanocas')
+
+SHARD_PATTERN = re.compile(r'^L(\d+)-(\d+)\.bam$')
+
+
+class AlignmentStore:
+    """Append-only store of coordinate-sorted BAM shards.
+
+    Every ingested batch becomes its own level-0 shard, so an ingest costs the
+    size of the batch. A background thread compacts `fanout` shards of one
+    level into a single shard of the next level; inputs are already sorted, so
+    compaction is a streaming merge with no re-sort.
+
+    Once seal() is called, only level-0 shards up to the sealed sequence
+    number (those a checkpoint has counted) are compacted, so the newer ones
+    can still be dropped with discard_after() when resuming from it.
+    """
+
+    def __init__(self, shard_dir: str, fanout: int = 4):
+        self.shard_dir = shard_dir
+        self.fanout = fanout
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self.lock = Lock()
+        self.shards = []
+        self.next_seq = 0
+        self.sealed_seq = None  # None compacts every shard
+        for name in os.listdir(self.shard_dir):
+            match = SHARD_PATTERN.match(name)
+            if not match:
+                # Leftovers from an interrupted append or compaction
+                if name.startswith('tmp-'):
+                    os.remove(os.path.join(self.shard_dir, name))
+                continue
+            path = os.path.join(self.shard_dir, name)
+            if not os.path.exists(path + '.bai'):
+                pysam.index(path)
+            self.shards.append((int(match.group(1)), int(match.group(2)), path))
+            self.next_seq = max(self.next_seq, int(match.group(2)) + 1)
+        self.shards.sort(key=lambda shard: shard[1])
+
+        self._wakeup = Event()
+        self._stopped = Event()
+        self._compactor = Thread(target=self._compact_loop, daemon=True)
+        self._compactor.start()
+
+    def _allocate(self, level: int) -> tuple:
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+        return seq, os.path.join(self.shard_dir, f'L{level}-{seq:08d}.bam')
+
+    def append(self, bam_path: str, move: bool = False) -> str:
+        """Add a batch BAM as a new level-0 shard and return the shard path."""
+        seq, shard_path = self._allocate(0)
+        tmp_path = os.path.join(self.shard_dir, f'tmp-{seq:08d}.bam')
+        with pysam.AlignmentFile(bam_path, "rb", check_sq=False) as bam:
+            is_sorted = bam.header.to_dict().get('HD', {}).get('SO') == 'coordinate'
+        if not is_sorted:
+            pysam.sort('-o', tmp_path, bam_path)
+            if move:
+                os.remove(bam_path)
+        elif move:
+            shutil.move(bam_path, tmp_path)
+        else:
+            shutil.copy(bam_path, tmp_path)
+        pysam.index(tmp_path, shard_path + '.bai')
+        os.replace(tmp_path, shard_path)
+        with self.lock:
+            self.shards.append((0, seq, shard_path))
+        self._wakeup.set()
+        return shard_path
+
+    def adopt(self, bam_path: str):
+        """Take over a cumulative BAM written by an older nanoCAS version."""
+        logger.debug(f"Adopting {bam_path} into shard store {self.shard_dir}")
+        self.append(bam_path, move=True)
+        if os.path.exists(bam_path + '.bai'):
+            os.remove(bam_path + '.bai')
+
+    def last_seq(self) -> int:
+        """Sequence number of the newest shard, or -1 for an empty store."""
+        with self.lock:
+            return self.next_seq - 1
+
+    def seal(self, seq: int):
+        """Allow compaction of level-0 shards up to seq."""
+        with self.lock:
+            self.sealed_seq = seq
+        self._wakeup.set()
+
+    def discard_after(self, seq: int) -> int:
+        """Remove level-0 shards newer than seq, returning how many were removed."""
+        with self.lock:
+            stale = [shard for shard in self.shards if shard[0] == 0 and shard[1] > seq]
+            self.shards = [shard for shard in self.shards if shard not in stale]
+        for _, _, path in stale:
+            for stale_path in (path, path + '.bai'):
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+        return len(stale)
+
+    def shard_paths(self) -> list:
+        with self.lock:
+            return [path for _, _, path in self.shards]
+
+    def _compact_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                while not self._stopped.is_set() and self.compact_once():
+                    pass
+            except Exception as e:
+                logger.error(f"Error compacting shards in {self.shard_dir}: {e}")
+
+    def compact_once(self) -> bool:
+        """Merge the oldest `fanout` shards of the lowest full level. Returns False if nothing to do."""
+        with self.lock:
+            levels = {}
+            for shard in self.shards:
+                if shard[0] == 0 and self.sealed_seq is not None and shard[1] > self.sealed_seq:
+                    continue
+                levels.setdefault(shard[0], []).append(shard)
+            candidates = None
+            for level in sorted(levels):
+                if len(levels[level]) >= self.fanout:
+                    candidates = levels[level][:self.fanout]
+                    break
+        if candidates is None:
+            return False
+
+        level = candidates[0][0] + 1
+        seq, shard_path = self._allocate(level)
+        tmp_path = os.path.join(self.shard_dir, f'tmp-{seq:08d}.bam')
+        pysam.merge('-f', '-c', '-p', tmp_path, *[path for _, _, path in candidates])
+        pysam.index(tmp_path, shard_path + '.bai')
+        os.replace(tmp_path, shard_path)
+        with self.lock:
+            self.shards = [shard for shard in self.shards if shard not in candidates]
+            self.shards.append((level, seq, shard_path))
+            self.shards.sort(key=lambda shard: shard[1])
+        for _, _, path in candidates:
+            for stale in (path, path + '.bai'):
+                if os.path.exists(stale):
+                    os.remove(stale)
+        logger.debug(f"Compacted {len(candidates)} shards into {shard_path}")
+        return True
+
+    def fetch(self, contig: str = None, start: int = None, stop: int = None):
+        """Yield alignments across all shards in coordinate order."""
+        files = [pysam.AlignmentFile(path, "rb", check_sq=False) for path in self.shard_paths()]
+        try:
+            if contig is None:
+                iterators = [bam.fetch(until_eof=True) for bam in files]
+            else:
+                iterators = [bam.fetch(contig, start, stop) for bam in files if contig in bam.references]
+            key = lambda segment: (segment.reference_id < 0, segment.reference_id, segment.reference_start)
+            yield from heapq.merge(*iterators, key=key)
+        finally:
+            for bam in files:
+                bam.close()
+
+    def count(self, contig: str) -> int:
+        """Number of alignments on a reference, summed across shards."""
+        total = 0
+        for path in self.shard_paths():
+            with pysam.AlignmentFile(path, "rb", check_sq=False) as bam:
+                if contig in bam.references:
+                    total += bam.count(contig)
+        return total
+
+    @property
+    def unmapped(self) -> int:
+        total = 0
+        for path in self.shard_paths():
+            with pysam.AlignmentFile(path, "rb", check_sq=False) as bam:
+                total += bam.unmapped
+        return total
+
+    def export(self, output_path: str):
+        """Write a single merged, indexed BAM of every shard (e.g. for download)."""
+        paths = self.shard_paths()
+        if not paths:
+            return None
+        pysam.merge('-f', '-c', '-p', output_path, *paths)
+        pysam.index(output_path)
+        return output_path
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        self._compactor.join(timeout=5)
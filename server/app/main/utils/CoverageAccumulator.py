@@ -0,0 +1,195 @@
+import logging
+from threading import Lock
+
+import numpy as np
+import pysam
+
+logger = logging.getLogger('nanocas')
+
+# Flags skipped by pysam's count_coverage (read_callback='all'):
+# unmapped, secondary, QC fail and duplicate.
+SKIP_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+# CIGAR operations that consume both query and reference (M, =, X)
+MATCH_OPS = (0, 7, 8)
+QUERY_OPS = (0, 1, 4, 7, 8)
+REF_OPS = (0, 2, 3, 7, 8)
+ACGT = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+
+def aligned_reference_positions(segment, quality_threshold: int = 15):
+    """Reference positions of aligned bases that pass the count_coverage filters."""
+    sequence = segment.query_sequence
+    if not sequence:
+        return None
+    q_parts, r_parts = [], []
+    q, r = 0, segment.reference_start
+    for op, length in segment.cigartuples:
+        if op in MATCH_OPS:
+            q_parts.append(np.arange(q, q + length))
+            r_parts.append(np.arange(r, r + length))
+        if op in QUERY_OPS:
+            q += length
+        if op in REF_OPS:
+            r += length
+    if not q_parts:
+        return None
+    q_pos = np.concatenate(q_parts)
+    r_pos = np.concatenate(r_parts)
+
+    bases = np.frombuffer(sequence.encode(), dtype=np.uint8)
+    keep = np.isin(bases[q_pos], ACGT)
+    qualities = segment.query_qualities
+    if qualities is not None:
+        qualities = np.asarray(qualities, dtype=np.uint8)
+        keep &= qualities[q_pos] >= quality_threshold
+    return r_pos[keep]
+
+
+class CoverageAccumulator:
+    """Per-project coverage state kept in memory and updated batch by batch.
+
+    Holds one depth array per reference so a new batch only costs the reads
+    it contains, instead of re-scanning the whole cumulative BAM.
+    """
+
+    def __init__(self, quality_threshold: int = 15):
+        self.quality_threshold = quality_threshold
+        self.references = []
+        self.lengths = {}
+        self.depth = {}
+        self.depth_sum = {}
+        self.covered = {}
+        self.read_counts = {}
+        self.unmapped = 0
+        self.lock = Lock()
+
+    def ensure_references(self, names, lengths):
+        """Register references (in header order) that are not yet tracked."""
+        with self.lock:
+            for name, length in zip(names, lengths):
+                if name in self.lengths:
+                    continue
+                self.references.append(name)
+                self.lengths[name] = int(length)
+                self.depth[name] = np.zeros(int(length), dtype=np.uint32)
+                self.depth_sum[name] = 0
+                self.covered[name] = 0
+                self.read_counts[name] = 0
+
+    def add_segment(self, segment) -> str | None:
+        """Fold one alignment into the state, returning the reference it touched."""
+        if segment.is_unmapped:
+            self.unmapped += 1
+        ref = segment.reference_name if segment.reference_id >= 0 else None
+        if ref is None or ref not in self.depth:
+            return None
+        self.read_counts[ref] += 1
+        if segment.flag & SKIP_FLAGS or segment.cigartuples is None:
+            return ref
+
+        ref_pos = aligned_reference_positions(segment, self.quality_threshold)
+        if ref_pos is None or ref_pos.size == 0:
+            return ref
+        depth = self.depth[ref]
+        ref_pos = ref_pos[ref_pos < depth.size]
+        self.covered[ref] += int(np.count_nonzero(depth[ref_pos] == 0))
+        depth[ref_pos] += 1
+        self.depth_sum[ref] += int(ref_pos.size)
+        return ref
+
+    def add_bam(self, bam_path: str) -> set:
+        """Fold every alignment of a batch BAM into the state."""
+        touched = set()
+        with pysam.AlignmentFile(bam_path, "rb", check_sq=False) as bam:
+            self.ensure_references(bam.references, bam.lengths)
+            with self.lock:
+                for segment in bam.fetch(until_eof=True):
+                    ref = self.add_segment(segment)
+                    if ref is not None:
+                        touched.add(ref)
+        return touched
+
+    def to_delta(self) -> dict:
+        """The whole state as a compact, JSON-serializable delta for add_delta.
+
+        Depth is run-length encoded as [starts, ends, values] over the
+        non-zero stretches of each reference.
+        """
+        with self.lock:
+            depth = {}
+            for ref in self.references:
+                values = self.depth[ref]
+                change = np.flatnonzero(np.diff(values, prepend=0, append=0))
+                starts, ends = change[:-1], change[1:]
+                runs = values[starts] > 0 if starts.size else np.zeros(0, dtype=bool)
+                depth[ref] = [starts[runs].tolist(), ends[runs].tolist(), values[starts[runs]].tolist()]
+            return {
+                'references': [[ref, self.lengths[ref]] for ref in self.references],
+                'depth': depth,
+                'read_counts': dict(self.read_counts),
+                'unmapped': self.unmapped
+            }
+
+    def add_delta(self, delta: dict):
+        """Fold in a delta from to_delta(), e.g. one computed by a remote worker."""
+        names = [name for name, _ in delta['references']]
+        lengths = [length for _, length in delta['references']]
+        self.ensure_references(names, lengths)
+        with self.lock:
+            self.unmapped += delta['unmapped']
+            for ref, count in delta['read_counts'].items():
+                self.read_counts[ref] += count
+            for ref, (starts, ends, values) in delta['depth'].items():
+                depth = self.depth[ref]
+                for start, end, value in zip(starts, ends, values):
+                    run = depth[start:end]
+                    self.covered[ref] += int(np.count_nonzero(run == 0))
+                    run += value
+                    self.depth_sum[ref] += (end - start) * value
+
+    def state(self) -> dict:
+        """Copy of the full state as plain values and depth arrays, for a checkpoint."""
+        with self.lock:
+            return {
+                'references': [[ref, self.lengths[ref]] for ref in self.references],
+                'depth': {ref: self.depth[ref].copy() for ref in self.references},
+                'read_counts': dict(self.read_counts),
+                'unmapped': self.unmapped
+            }
+
+    def restore(self, state: dict):
+        """Replace the state with one from state(); depth sums and breadth are recomputed."""
+        names = [name for name, _ in state['references']]
+        lengths = {name: int(length) for name, length in state['references']}
+        depth = {name: np.asarray(state['depth'][name], dtype=np.uint32) for name in names}
+        for name in names:
+            if depth[name].size != lengths[name]:
+                raise ValueError(f"Depth of {name} has {depth[name].size} positions, expected {lengths[name]}")
+        with self.lock:
+            self.references = names
+            self.lengths = lengths
+            self.depth = depth
+            self.depth_sum = {name: int(depth[name].sum(dtype=np.uint64)) for name in names}
+            self.covered = {name: int(np.count_nonzero(depth[name])) for name in names}
+            self.read_counts = {name: int(state['read_counts'].get(name, 0)) for name in names}
+            self.unmapped = int(state['unmapped'])
+
+    def summary(self, ref: str) -> dict:
+        """Depth (average), breadth (%) and read count for one reference."""
+        length = self.lengths[ref]
+        return {
+            "depth": self.depth_sum[ref] / length if length > 0 else 0,
+            "breadth": (self.covered[ref] / length) * 100 if length > 0 else 0,
+            "read_count": self.read_counts[ref]
+        }
+
+    def snapshot(self) -> dict:
+        """Coverage of every known reference plus the unmapped read count."""
+        with self.lock:
+            coverage_data = {ref: self.summary(ref) for ref in self.references}
+            coverage_data['unmapped'] = {
+                "depth": 0.0,
+                "breadth": 0.0,
+                "read_count": self.unmapped
+            }
+        return coverage_data
@@ -0,0 +1,145 @@
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from threading import Lock
+
+from app import socketio
+from .concurrency import call_soon
+
+logger = logging.getLogger('nanocas')
+
+# Most coverage_update messages sent per second to a project's room; later updates are merged
+UPDATES_PER_SECOND = float(os.getenv('NANOCAS_COVERAGE_UPDATES_PER_SECOND', 2))
+# Recent updates kept per project for clients resuming after a disconnect
+HISTORY_SIZE = int(os.getenv('NANOCAS_COVERAGE_HISTORY', 256))
+
+_broadcasters = {}
+_broadcasters_lock = Lock()
+
+
+def coverage_room(project_id: str) -> str:
+    return f"coverage:{project_id}"
+
+
+class CoverageBroadcaster:
+    """Sends a project's coverage to the clients in its room.
+
+    publish() only records the latest coverage; at most UPDATES_PER_SECOND
+    times a second the references whose values changed since the last
+    update are emitted as a coverage_update. Clients get the full state
+    from snapshot() when they join.
+
+    Every update carries the stream's epoch and a sequence number, and the
+    last HISTORY_SIZE updates are kept so a reconnecting client can be sent
+    just the ones it missed (see resume()).
+    """
+
+    def __init__(self, project_id: str, rate: float = UPDATES_PER_SECOND, history_size: int = HISTORY_SIZE):
+        self.project_id = project_id
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.epoch = uuid.uuid4().hex[:8]  # Sequence numbers restart with each broadcaster
+        self.seq = 0
+        self.history = deque(maxlen=history_size)
+        self.lock = Lock()
+        self.sent = {}  # reference -> values as of the last update
+        self.timestamp = None
+        self.pending = None  # (timestamp, coverage, partial) not yet sent
+        self.last_flush = 0.0
+        self.flush_scheduled = False
+
+    def publish(self, timestamp: str, coverage: dict, partial: bool = False):
+        with self.lock:
+            self.pending = (timestamp, coverage, partial)
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+            delay = self.last_flush + self.interval - time.monotonic()
+        # Emitting is left to the server, as publish() is called from pipeline threads
+        call_soon(self._flush_later, max(delay, 0.0))
+
+    def _flush_later(self, delay: float):
+        if delay > 0:
+            socketio.sleep(delay)
+        self.flush()
+
+    def flush(self):
+        """Emit the pending update. Only one flush runs at a time, so updates leave in seq order."""
+        with self.lock:
+            self.last_flush = time.monotonic()
+            update = self._take_pending()
+            if update is None:
+                self.flush_scheduled = False
+                return
+        socketio.emit('coverage_update', update, to=coverage_room(self.project_id))
+        with self.lock:
+            # Coverage published while emitting goes out one interval later
+            if self.pending is None:
+                self.flush_scheduled = False
+                return
+        call_soon(self._flush_later, self.interval)
+
+    def _take_pending(self) -> dict | None:
+        if self.pending is None:
+            return None
+        timestamp, coverage, partial = self.pending
+        self.pending = None
+        changed = {ref: values for ref, values in coverage.items() if self.sent.get(ref) != values}
+        if not changed:
+            return None
+        self.sent.update(changed)
+        self.timestamp = timestamp
+        self.seq += 1
+        update = {
+            'projectId': self.project_id,
+            'epoch': self.epoch,
+            'seq': self.seq,
+            'timestamp': timestamp,
+            'coverage': changed,
+            'partial': partial
+        }
+        self.history.append(update)
+        return update
+
+    def seed(self, timestamp: str, coverage: dict):
+        """Start from stored coverage, e.g. the timeline's latest rows, if nothing was published yet."""
+        with self.lock:
+            if self.timestamp is None:
+                self.sent = dict(coverage)
+                self.timestamp = timestamp
+
+    def snapshot(self) -> dict:
+        """Full coverage as of the last update, for a client joining the room."""
+        with self.lock:
+            return {
+                'projectId': self.project_id,
+                'epoch': self.epoch,
+                'seq': self.seq,
+                'timestamp': self.timestamp,
+                'coverage': dict(self.sent)
+            }
+
+    def resume(self, epoch: str, last_seq: int) -> list | None:
+        """Updates after last_seq, or None if they are no longer all held and a snapshot is needed."""
+        with self.lock:
+            if epoch != self.epoch or last_seq > self.seq:
+                return None
+            if last_seq == self.seq:
+                return []
+            if not self.history or self.history[0]['seq'] > last_seq + 1:
+                return None
+            return [update for update in self.history if update['seq'] > last_seq]
+
+
+def get_broadcaster(project_id: str) -> CoverageBroadcaster:
+    with _broadcasters_lock:
+        broadcaster = _broadcasters.get(project_id)
+        if broadcaster is None:
+            broadcaster = _broadcasters[project_id] = CoverageBroadcaster(project_id)
+        return broadcaster
+
+
+def release_broadcaster(project_id: str):
+    with _broadcasters_lock:
+        _broadcasters.pop(project_id, None)
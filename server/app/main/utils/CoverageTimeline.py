@@ -0,0 +1,169 @@
+import calendar
+import datetime
+import logging
+import os
+import sqlite3
+from threading import Lock
+
+logger = logging.getLogger('nanocas')
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Bucket width in seconds for each resolution; raw keeps every recorded row
+RESOLUTIONS = {'raw': 0, '1min': 60, '10min': 600}
+
+_timelines = {}
+_timelines_lock = Lock()
+
+
+def to_epoch(timestamp: str) -> int:
+    """Seconds for a coverage timestamp string (treated as naive wall-clock time)."""
+    return calendar.timegm(datetime.datetime.strptime(timestamp, TIMESTAMP_FORMAT).timetuple())
+
+
+def from_epoch(ts: int) -> str:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+class CoverageTimeline:
+    """Coverage history of a project in SQLite, indexed by (resolution, reference, timestamp).
+
+    Rows are kept at 'raw' resolution, one per reference per second, and
+    folded into 1-minute and 10-minute rollups. Coverage values are
+    cumulative, so rows recorded within the same second (e.g. files sharing
+    an mtime) collapse into the latest one, and a rollup bucket likewise
+    holds the latest row that fell into it.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS coverage (
+                resolution INTEGER NOT NULL,
+                reference TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                last_ts INTEGER NOT NULL,
+                depth REAL NOT NULL,
+                breadth REAL NOT NULL,
+                read_count INTEGER NOT NULL,
+                PRIMARY KEY (resolution, reference, ts)
+            ) WITHOUT ROWID''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS coverage_by_time ON coverage (resolution, ts)')
+        self.conn.commit()
+
+    @classmethod
+    def open(cls, app_loc: str):
+        """Open a project's timeline, importing an existing coverage.csv the first time."""
+        db_path = os.path.join(app_loc, 'coverage.db')
+        csv_path = os.path.join(app_loc, 'coverage.csv')
+        is_new = not os.path.exists(db_path)
+        timeline = cls(db_path)
+        if is_new and os.path.exists(csv_path):
+            timeline.import_csv(csv_path)
+        return timeline
+
+    def _rows(self, ts: int, coverage_data: dict):
+        for width in RESOLUTIONS.values():
+            bucket = ts - ts % width if width else ts
+            for ref, cov in coverage_data.items():
+                yield (width, ref, bucket, ts, cov['depth'], cov['breadth'], cov['read_count'])
+
+    def _insert(self, rows):
+        self.conn.executemany('''
+            INSERT INTO coverage (resolution, reference, ts, last_ts, depth, breadth, read_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (resolution, reference, ts) DO UPDATE SET
+                last_ts = excluded.last_ts, depth = excluded.depth,
+                breadth = excluded.breadth, read_count = excluded.read_count
+            WHERE excluded.last_ts >= coverage.last_ts''', rows)
+
+    def record(self, timestamp: str, coverage_data: dict):
+        """Store one row per reference at timestamp, updating the rollups."""
+        with self.lock:
+            self._insert(self._rows(to_epoch(timestamp), coverage_data))
+            self.conn.commit()
+
+    def import_csv(self, csv_path: str):
+        """Load rows from a legacy coverage.csv (timestamp,reference,depth,breadth,read_count)."""
+        count = 0
+        with self.lock, open(csv_path, 'r') as f:
+            for line in f:
+                parts = line.strip().split(',')
+                if len(parts) != 5 or parts[0] == 'timestamp':
+                    continue
+                timestamp, ref, depth, breadth, read_count = parts
+                try:
+                    cov = {'depth': float(depth), 'breadth': float(breadth), 'read_count': int(read_count)}
+                    self._insert(self._rows(to_epoch(timestamp), {ref: cov}))
+                except ValueError as e:
+                    logger.error(f"Skipping malformed coverage row {line.strip()}: {e}")
+                    continue
+                count += 1
+            self.conn.commit()
+        logger.debug(f"Imported {count} coverage rows from {csv_path}")
+
+    def query(self, resolution: str = 'raw', since: str = None, references: list = None) -> list:
+        """Rows at a resolution, oldest first, as timestamp/reference/depth/breadth/read_count dicts.
+
+        since keeps only rows updated strictly after that timestamp, so a
+        rollup bucket that started earlier but is still being filled is
+        included; references keeps only the listed references.
+        """
+        width = RESOLUTIONS[resolution]
+        sql = 'SELECT ts, reference, depth, breadth, read_count FROM coverage WHERE resolution = ?'
+        params = [width]
+        if since is not None:
+            since_ts = to_epoch(since)
+            sql += ' AND ts >= ? AND last_ts > ?'
+            params.extend([since_ts - since_ts % width if width else since_ts, since_ts])
+        if references is not None:
+            sql += f" AND reference IN ({','.join('?' * len(references))})"
+            params.extend(references)
+        sql += ' ORDER BY ts, reference'
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [{
+            'timestamp': from_epoch(ts),
+            'reference': ref,
+            'depth': depth,
+            'breadth': breadth,
+            'read_count': read_count
+        } for ts, ref, depth, breadth, read_count in rows]
+
+    def latest(self):
+        """(timestamp, coverage) of the most recent raw row of each reference; timestamp is None if empty."""
+        with self.lock:
+            rows = self.conn.execute('''
+                SELECT reference, ts, depth, breadth, read_count FROM coverage AS c
+                WHERE resolution = 0 AND ts = (
+                    SELECT MAX(ts) FROM coverage WHERE resolution = 0 AND reference = c.reference)''').fetchall()
+        if not rows:
+            return None, {}
+        coverage = {ref: {'depth': depth, 'breadth': breadth, 'read_count': read_count}
+                    for ref, _, depth, breadth, read_count in rows}
+        return from_epoch(max(ts for _, ts, _, _, _ in rows)), coverage
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def get_timeline(app_loc: str) -> CoverageTimeline:
+    """Shared timeline for a project directory, opened on first use."""
+    key = os.path.normpath(app_loc)
+    with _timelines_lock:
+        timeline = _timelines.get(key)
+        if timeline is None:
+            timeline = _timelines[key] = CoverageTimeline.open(key)
+        return timeline
+
+
+def release_timeline(app_loc: str):
+    """Close a project's shared timeline (e.g. before its directory is deleted)."""
+    with _timelines_lock:
+        timeline = _timelines.pop(os.path.normpath(app_loc), None)
+    if timeline is not None:
+        timeline.close()
@@ -0,0 +1,49 @@
+import logging
+from threading import Lock
+
+from .CoverageAccumulator import SKIP_FLAGS, aligned_reference_positions
+
+logger = logging.getLogger('nanocas')
+
+
+class DepthMonitor:
+    """Running average depth per reference, updated read by read as alignments leave the aligner.
+
+    Counts the same bases as CoverageAccumulator, but without waiting for the
+    batch to be committed, and calls on_cross(ref, depth) on the read that
+    takes a reference from below one of its thresholds (from an
+    AlertRuleIndex) to at or above it.
+    """
+
+    def __init__(self, rules, on_cross, quality_threshold: int = 15):
+        self.rules = rules
+        self.on_cross = on_cross
+        self.quality_threshold = quality_threshold
+        self.depth_sum = {}
+        self.lock = Lock()
+
+    def seed(self, accumulator):
+        """Start from the committed totals of a CoverageAccumulator."""
+        with self.lock:
+            self.depth_sum = dict(accumulator.depth_sum)
+
+    def add_segment(self, segment):
+        if segment.flag & SKIP_FLAGS or segment.cigartuples is None or segment.reference_id < 0:
+            return
+        ref = segment.reference_name
+        thresholds = self.rules.thresholds_for(ref)
+        if not thresholds:
+            return
+        ref_pos = aligned_reference_positions(segment, self.quality_threshold)
+        if ref_pos is None or ref_pos.size == 0:
+            return
+        length = segment.header.get_reference_length(ref)
+        if length <= 0:
+            return
+        with self.lock:
+            before = self.depth_sum.get(ref, 0)
+            after = self.depth_sum[ref] = before + int(ref_pos.size)
+        crossed = any(before / length < threshold <= after / length for threshold in thresholds)
+        if crossed:
+            logger.debug(f"Reference {ref} crossed a threshold at read {segment.query_name}")
+            self.on_cross(ref, after / length)
@@ -2,88 +2,233 @@ import datetime
 import json
 import logging
 import os
-import shutil
 import subprocess
 import sys
 import time
 import glob
 import pysam
-import numpy as np
-from threading import Lock
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Lock, Thread
 from watchdog.events import FileSystemEventHandler
-from app import socketio
+from .AlertRuleIndex import get_rule_index
+from .AlertState import AlertState
+from .AlignmentStore import AlignmentStore
+from .CoverageAccumulator import CoverageAccumulator
+from .CoverageBroadcaster import get_broadcaster
+from .CoverageTimeline import get_timeline
+from .DepthMonitor import DepthMonitor
+from .IngestLedger import IngestLedger
+from .IngestQueue import IngestQueue
 from .LinuxNotification import LinuxNotification
+from .NotificationDispatcher import get_dispatcher
+from .ProjectCheckpoint import ProjectCheckpoint
+from .ResidentAligner import ResidentAligner
+from .fastx import read_fastx_chunks, write_fastx
 from .email import send_email
 from .sms import send_sms
+from .executor import get_executor
 
 logger = logging.getLogger('nanocas')
 
+# Number of files aligned in parallel per project
+ALIGN_WORKERS = int(os.getenv('NANOCAS_ALIGN_WORKERS', os.cpu_count() or 1))
+# Reads per streamed chunk; 0 aligns each file as a single batch
+CHUNK_READS = int(os.getenv('NANOCAS_CHUNK_READS', 10000))
+# Send FASTQ chunks to the executor's workers instead of aligning them in this process
+DISTRIBUTED = os.getenv('ENABLE_DISTRIBUTED', 'false').lower() == 'true'
+# Chunks of a file queued on the executor at once in distributed mode
+REMOTE_CHUNKS_IN_FLIGHT = int(os.getenv('NANOCAS_REMOTE_CHUNKS_IN_FLIGHT', 4))
+# Seconds between checkpoints of the project's state, taken between files
+CHECKPOINT_INTERVAL = float(os.getenv('NANOCAS_CHECKPOINT_INTERVAL', 60))
+
+# One prepared batch of a file: a BAM to keep (or None) and, for remote batches, its coverage delta
+Batch = namedtuple('Batch', ['bam', 'move', 'is_last', 'delta'], defaults=[None])
+
 class FileHandler(FileSystemEventHandler):
     def __init__(self, app_loc: str):
         self.app_loc = app_loc
         self.num_files_classified = 0
         self.merged_bam = os.path.join(self.app_loc, 'merged.bam')
-        self.coverage_file = os.path.join(self.app_loc, 'coverage.csv')
-        self.processed_files_path = os.path.join(self.app_loc, 'processed_files.txt')
-        self.processed_files = set()
+        self.timeline = get_timeline(self.app_loc)
+        # Processed files by identity, so a rewritten file is processed again
+        self.ledger = IngestLedger.open(self.app_loc)
+        self.pending_files = set()  # Submitted but not yet committed
         self.processed_files_lock = Lock()  # Add lock for thread safety
-        # Load previously processed files
-        if os.path.exists(self.processed_files_path):
-            with open(self.processed_files_path, 'r') as f:
-                self.processed_files = set(f.read().splitlines())
         with open(os.path.join(self.app_loc, 'alertinfo.cfg'), 'r') as f:
             self.config = json.load(f)
         self.file_type = self.config.get('fileType', 'FASTQ')
+        if self.file_type == 'FASTQ':
+            self.extensions = ('.fastq', '.fasta', '.fastq.gz', '.fq.gz')
+        elif self.file_type == 'BAM':
+            self.extensions = ('.bam',)
+        else:
+            self.extensions = ()
+        # Sorted per-batch shards; a merged.bam from an older run becomes the first shard
+        self.alignments = AlignmentStore(os.path.join(self.app_loc, 'shards'))
+        adopted = False
+        if os.path.exists(self.merged_bam) and self.is_bam_valid(self.merged_bam):
+            self.alignments.adopt(self.merged_bam)
+            adopted = True
+        # Which alerts have fired, so each threshold crossing notifies once, even across restarts
+        self.alert_state = AlertState(os.path.join(self.app_loc, 'alert_state.json'))
+        # In-memory coverage state, resumed from the last checkpoint or rebuilt from the stored shards
+        self.coverage = CoverageAccumulator()
+        self.checkpoint = ProjectCheckpoint(os.path.join(self.app_loc, 'checkpoint.npz'))
+        self.last_checkpoint = time.monotonic()
+        if adopted or not self.resume_from_checkpoint():
+            self.rebuild_coverage()
+        self.broadcaster = get_broadcaster(self.config.get('projectId', ''))
+        # Alert rules compiled from alertinfo.cfg, refreshed once per batch
+        self.rules = get_rule_index(self.app_loc)
+        # Read-level threshold checks, run on the workers as reads leave the aligner
+        self.depth_monitor = DepthMonitor(self.rules, self.on_threshold_crossed)
+        self.depth_monitor.seed(self.coverage)
+        # minimap2 index kept in memory across files, loaded on first use
+        self.aligner = None
+        self.aligner_lock = Lock()
+        # Files are aligned on a worker pool; a single committer applies results in submission order
+        self.workers = ThreadPoolExecutor(max_workers=ALIGN_WORKERS)
+        self.commit_queue = Queue()
+        self.committer = Thread(target=self._commit_loop, daemon=True)
+        self.committer.start()
+        # Coalesces watchdog events and the backlog scan into one stream of ready files
+        self.ingest = IngestQueue(self.on_file_ready, accepts=self.accepts)
 
-    def on_moved(self, event):
-        self.on_any_event(event)
+    def accepts(self, path: str) -> bool:
+        """Whether path is an input file of the project's type that has not been seen yet."""
+        if not path.endswith(self.extensions):
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        with self.processed_files_lock:
+            return path not in self.pending_files and not self.ledger.seen(path, stat)
 
     def on_any_event(self, event):
-        src_path = event.src_path
+        if event.is_directory:
+            return
+        if event.event_type == 'moved':
+            self.ingest.discard(event.src_path)
+            self.ledger.move(event.src_path, event.dest_path)
+            self.ingest.push(event.dest_path)
+        elif event.event_type == 'deleted':
+            self.ingest.discard(event.src_path)
+            self.ledger.forget(event.src_path)
+        elif event.event_type == 'closed':
+            self.ingest.push(event.src_path, closed=True)
+        elif event.event_type in ('created', 'modified'):
+            self.ingest.push(event.src_path)
+
+    def on_file_ready(self, src_path: str, stat: os.stat_result):
+        timestamp = datetime.datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+        logger.debug(f'Queueing {self.file_type} file: {src_path} with timestamp {timestamp}')
+        self.submit_file(src_path, timestamp, stat)
+
+    def submit_file(self, src_path: str, timestamp: str = None, stat: os.stat_result = None):
+        """Align a file on the worker pool and queue its results for the committer."""
+        if stat is None:
+            stat = os.stat(src_path)
         with self.processed_files_lock:
-            if src_path in self.processed_files:
-                logger.debug(f"Skipping already processed file: {src_path}")
+            if src_path in self.pending_files or self.ledger.seen(src_path, stat):
                 return
-        if not self.wait_for_file_stability(src_path):
-            logger.error(f"File {src_path} is not stable, skipping.")
+            self.pending_files.add(src_path)
+            results = Queue()
+            self.workers.submit(self.prepare_file, src_path, results)
+            self.commit_queue.put((src_path, timestamp, stat, results))
+
+    def prepare_file(self, src_path: str, results: Queue):
+        """Worker stage: put the file's Batches on results, then None."""
+        try:
+            if self.file_type == 'FASTQ' and DISTRIBUTED:
+                for batch in self.align_fastq_chunks_remote(src_path):
+                    results.put(batch)
+            elif self.file_type == 'FASTQ':
+                for bam, is_last in self.align_fastq_chunks(src_path):
+                    results.put(Batch(bam, True, is_last))
+            elif self.file_type == 'BAM':
+                if self.is_bam_valid(src_path):
+                    results.put(Batch(src_path, False, True))
+                else:
+                    logger.error(f"Skipping invalid BAM file: {src_path}")
+        except Exception as e:
+            logger.error(f"Error preparing file {src_path}: {e}")
+        finally:
+            results.put(None)
+
+    def _commit_loop(self):
+        """Committer stage: apply prepared batches one at a time, in submission order."""
+        while True:
+            item = self.commit_queue.get()
+            if item is None:
+                break
+            src_path, timestamp, stat, results = item
+            try:
+                partial = False
+                while (batch := results.get()) is not None:
+                    self.commit_bam(batch.bam, timestamp, move=batch.move, partial=not batch.is_last,
+                                    delta=batch.delta)
+                    partial = not batch.is_last
+                if partial:
+                    # The stream stopped before its last chunk; record what was committed
+                    self.record_coverage(timestamp, self.coverage.snapshot())
+            except Exception as e:
+                logger.error(f"Error processing file {src_path}: {e}")
+            finally:
+                self.mark_processed(src_path, stat)
+                if time.monotonic() - self.last_checkpoint >= CHECKPOINT_INTERVAL:
+                    self.write_checkpoint()
+
+    def resume_from_checkpoint(self) -> bool:
+        """Restore coverage, processed files and alert state from the last checkpoint.
+
+        Shards appended after the checkpoint are dropped and their files are
+        processed again, so a file cut off by a crash counts exactly once.
+        Returns False if there is no usable checkpoint.
+        """
+        checkpoint = self.checkpoint.load()
+        if checkpoint is None:
+            return False
+        try:
+            self.coverage.restore(checkpoint['coverage'])
+        except (KeyError, ValueError) as e:
+            logger.error(f"Checkpoint {self.checkpoint.path} doesn't match its coverage state: {e}")
+            return False
+        dropped = self.alignments.discard_after(checkpoint['shard_seq'])
+        self.alignments.seal(checkpoint['shard_seq'])
+        self.ledger.truncate(checkpoint['ledger_seq'])
+        # alert_state.json is saved on every change, so it is only replaced if it was lost
+        if not self.alert_state.state and checkpoint['alert_state']:
+            self.alert_state.restore(checkpoint['alert_state'])
+        logger.debug(f"Resumed {self.app_loc} from its checkpoint; dropped {dropped} newer shards")
+        return True
+
+    def rebuild_coverage(self):
+        """Recount coverage from every stored shard, then checkpoint it for the next restart."""
+        self.coverage = CoverageAccumulator()
+        for shard in self.alignments.shard_paths():
+            logger.debug(f"Rebuilding coverage state from {shard}")
+            self.coverage.add_bam(shard)
+        self.write_checkpoint()
+
+    def write_checkpoint(self):
+        """Atomically save the project's state. Runs between files, when coverage matches the processed files."""
+        shard_seq = self.alignments.last_seq()
+        try:
+            ledger_seq = self.ledger.flush()
+            self.checkpoint.write(self.coverage.state(), ledger_seq, self.alert_state.snapshot(), shard_seq)
+        except Exception as e:
+            logger.error(f"Error writing checkpoint {self.checkpoint.path}: {e}")
             return
-        mtime = os.path.getctime(src_path)
-        timestamp = datetime.datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S")
-        if self.file_type == 'FASTQ' and src_path.endswith((".fastq", ".fasta", ".fastq.gz", ".fq.gz")):
-            logger.debug(f'Processing FASTQ file: {src_path} with timestamp {timestamp}')
-            self.process_fastq_file(src_path, timestamp)
-        elif self.file_type == 'BAM' and src_path.endswith(".bam"):
-            logger.debug(f'Processing BAM file: {src_path} with timestamp {timestamp}')
-            self.process_bam_file(src_path, timestamp)
-        else:
-            logger.debug(f"Ignoring file {src_path} as it does not match expected type {self.file_type}")
-        # Mark file as processed
+        self.alignments.seal(shard_seq)
+        self.last_checkpoint = time.monotonic()
+
+    def mark_processed(self, src_path: str, stat: os.stat_result):
         with self.processed_files_lock:
-            self.processed_files.add(src_path)
-            with open(self.processed_files_path, 'a') as f:
-                f.write(src_path + '\n')
-
-    def wait_for_file_stability(self, file_path, timeout=60, interval=1):
-        """Ensure file is fully written by checking size stability."""
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            if not os.path.exists(file_path):
-                logger.error(f"File {file_path} no longer exists.")
-                return False
-            try:
-                size1 = os.path.getsize(file_path)
-                time.sleep(interval)
-                if not os.path.exists(file_path):
-                    logger.error(f"File {file_path} no longer exists.")
-                    return False
-                size2 = os.path.getsize(file_path)
-                if size1 == size2:
-                    return True
-            except OSError as e:
-                logger.error(f"Error checking file size for {file_path}: {e}")
-                return False
-        logger.warning(f"File {file_path} did not stabilize within {timeout} seconds.")
-        return False
+            self.pending_files.discard(src_path)
+            self.ledger.add(stat, src_path)
 
     def is_bam_valid(self, bam_file):
         """Check if a BAM file is valid."""
@@ -94,42 +239,100 @@ class FileHandler(FileSystemEventHandler):
             logger.error(f"BAM file {bam_file} is invalid or corrupted: {e}")
             return False
 
-    def process_fastq_file(self, src_path: str, timestamp: str = None):
-        """Process FASTQ file by aligning to database and calculating coverage."""
+    def align_fastq_chunks(self, src_path: str):
+        """Align a FASTQ file in chunks of CHUNK_READS reads, yielding (sorted BAM, is_last)."""
         index_file = self.get_index_file()
         if not index_file:
             return
+        name = os.path.basename(src_path)
+        for i, (reads, is_last) in enumerate(read_fastx_chunks(src_path, CHUNK_READS)):
+            sorted_bam_output = os.path.join(self.app_loc, 'minimap2', 'runs', f'{name}_{i}_sorted.bam')
+            if not self.align_reads(index_file, reads, sorted_bam_output, src_path):
+                return
+            yield sorted_bam_output, is_last
 
-        # Generate sorted BAM directly with minimap2
-        sorted_bam_output = os.path.join(self.app_loc, 'minimap2', 'runs', f'{os.path.basename(src_path)}_sorted.bam')
-        cmd = f'minimap2 -a {index_file} {src_path} | samtools view -b | samtools sort -o {sorted_bam_output}'
-        try:
-            logger.debug(f"Running command: {cmd}")
-            subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error aligning FASTQ file {src_path}: {e.stderr.decode()}")
+    def align_fastq_chunks_remote(self, src_path: str):
+        """Align a FASTQ file's chunks on the executor's workers, yielding their Batches in chunk order.
+
+        At most REMOTE_CHUNKS_IN_FLIGHT chunks are queued at a time, so the
+        file streams through the workers instead of landing on the broker whole.
+        """
+        index_file = self.get_index_file()
+        if not index_file:
             return
+        name = os.path.basename(src_path)
+        executor = get_executor()
+        in_flight = deque()
+        for i, (reads, is_last) in enumerate(read_fastx_chunks(src_path, CHUNK_READS)):
+            sorted_bam_output = os.path.join(self.app_loc, 'minimap2', 'runs', f'{name}_{i}_sorted.bam')
+            job = executor.submit('align_batch', index_file, reads, sorted_bam_output, compression='gzip')
+            in_flight.append((i, job, is_last))
+            if len(in_flight) >= REMOTE_CHUNKS_IN_FLIGHT:
+                yield self._remote_batch(src_path, *in_flight.popleft())
+        while in_flight:
+            yield self._remote_batch(src_path, *in_flight.popleft())
+
+    def _remote_batch(self, src_path: str, i: int, job, is_last: bool) -> Batch:
+        result = job.get()
+        if result['bam'] is None:
+            logger.warning(f"Alignments of {src_path} chunk {i} were not kept: worker has no access to {self.app_loc}")
+        return Batch(result['bam'], True, is_last, result['delta'])
+
+    def align_reads(self, index_file: str, reads: list, sorted_bam_output: str, src_path: str) -> bool:
+        """Align a chunk of reads into a sorted batch BAM."""
+        aligner = self.get_aligner(index_file)
+        if aligner is not None:
+            try:
+                logger.debug(f"Aligning {len(reads)} reads from {src_path} against resident index {index_file}")
+                aligner.align_reads(reads, sorted_bam_output, on_segment=self.depth_monitor.add_segment)
+            except Exception as e:
+                logger.error(f"Error aligning FASTQ file {src_path}: {e}")
+                self.resync_depth_monitor()
+                return False
+        else:
+            chunk_fastq = sorted_bam_output + '.fastq'
+            write_fastx(reads, chunk_fastq)
+            cmd = f'minimap2 -a {index_file} {chunk_fastq} | samtools view -b | samtools sort -o {sorted_bam_output}'
+            try:
+                logger.debug(f"Running command: {cmd}")
+                subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except subprocess.CalledProcessError as e:
+                logger.error(f"Error aligning FASTQ file {src_path}: {e.stderr.decode()}")
+                return False
+            finally:
+                os.remove(chunk_fastq)
 
         if not self.is_bam_valid(sorted_bam_output):
             logger.error(f"Generated BAM file {sorted_bam_output} is invalid.")
             if os.path.exists(sorted_bam_output):
                 os.remove(sorted_bam_output)
-            return
+            if aligner is not None:
+                self.resync_depth_monitor()
+            return False
+        if aligner is None:
+            with pysam.AlignmentFile(sorted_bam_output, "rb", check_sq=False) as bam:
+                for segment in bam.fetch(until_eof=True):
+                    self.depth_monitor.add_segment(segment)
+        return True
 
-        # Merge and calculate coverage
-        self.merge_bam(sorted_bam_output)
-        self.calculate_and_record_coverage(timestamp)
-        # Clean up
-        if os.path.exists(sorted_bam_output):
-            os.remove(sorted_bam_output)
+    def resync_depth_monitor(self):
+        """Reset the monitor to the committed coverage, dropping reads of a chunk that failed after streaming.
+
+        Reads other workers streamed but haven't committed yet are dropped too;
+        their thresholds are still checked when they are committed.
+        """
+        self.depth_monitor.seed(self.coverage)
 
-    def process_bam_file(self, bam_path: str, timestamp: str = None):
-        """Process BAM file by merging and calculating coverage."""
-        if not self.is_bam_valid(bam_path):
-            logger.error(f"Skipping invalid BAM file: {bam_path}")
+    def commit_bam(self, bam_path: str, timestamp: str = None, move: bool = False, partial: bool = False,
+                   delta: dict = None):
+        """Calculate coverage from a batch BAM (or its precomputed delta), then keep it as a shard."""
+        self.calculate_and_record_coverage(bam_path, timestamp, partial=partial, delta=delta)
+        if bam_path is None:
             return
-        self.merge_bam(bam_path)
-        self.calculate_and_record_coverage(timestamp)
+        self.store_bam(bam_path, move=move)
+        # Clean up
+        if move and os.path.exists(bam_path):
+            os.remove(bam_path)
 
     def get_index_file(self) -> str | None:
         """Retrieve the database index file."""
@@ -139,138 +342,120 @@ class FileHandler(FileSystemEventHandler):
             return None
         return files[0]
 
-    def merge_bam(self, new_bam: str):
-        """Merge new BAM with existing merged BAM, ensuring sorted output."""
-        if not os.path.exists(self.merged_bam):
-            shutil.copy(new_bam, self.merged_bam)
-        else:
-            temp_merged = os.path.join(self.app_loc, 'temp_merged.bam')
-            try:
-                subprocess.run(['samtools', 'merge', temp_merged, self.merged_bam, new_bam], check=True)
-                shutil.move(temp_merged, self.merged_bam)
-            except subprocess.CalledProcessError as e:
-                logger.error(f"Error merging BAM files: {e}")
-                return
-        # Sort and index the merged BAM
+    def get_aligner(self, index_file: str) -> ResidentAligner | None:
+        """Return the project's resident aligner, loading the index on first use."""
+        with self.aligner_lock:
+            if self.aligner is not None and self.aligner.index_file != index_file:
+                self.aligner.close()
+                self.aligner = None
+            if self.aligner is None and ResidentAligner.available():
+                try:
+                    self.aligner = ResidentAligner(index_file)
+                except Exception as e:
+                    logger.error(f"Error loading index {index_file}, falling back to minimap2 CLI: {e}")
+            return self.aligner
+
+    def store_bam(self, new_bam: str, move: bool = False):
+        """Append a batch BAM to the project's shard store."""
         try:
-            sorted_merged = os.path.join(self.app_loc, 'merged_sorted.bam')
-            subprocess.run(['samtools', 'sort', self.merged_bam, '-o', sorted_merged], check=True)
-            shutil.move(sorted_merged, self.merged_bam)
-            subprocess.run(['samtools', 'index', self.merged_bam], check=True)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error sorting/indexing merged BAM: {e}")
-
-    def calculate_and_record_coverage(self, timestamp: str = None):
-        """Calculate and record depth coverage (average depth), breadth coverage, and read count per reference."""
+            self.alignments.append(new_bam, move=move)
+        except Exception as e:
+            logger.error(f"Error storing BAM file {new_bam}: {e}")
+
+    def calculate_and_record_coverage(self, new_bam: str, timestamp: str = None, partial: bool = False,
+                                      delta: dict = None):
+        """Update coverage from the alignments in new_bam and record depth, breadth and read count per reference.
+
+        A coverage delta computed by a remote worker is folded in instead of
+        reading new_bam. Partial batches (intermediate chunks of a streamed
+        file) emit a coverage_update but leave the coverage rows to the file's
+        last chunk.
+        """
         if timestamp is None:
             timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
         try:
-            bam = pysam.AlignmentFile(self.merged_bam, "rb", check_sq=False)
-            if not bam.has_index():
-                logger.error(f"Index missing for {self.merged_bam}")
-                return
-            coverage_data = {}
-            for ref in bam.references:
-                ref_length = bam.lengths[bam.references.index(ref)]
-                # Get coverage depth across all positions for this reference
-                coverage = bam.count_coverage(ref)
-                # Sum depths across all bases (A, C, G, T) at each position using NumPy
-                total_depth_per_position = np.sum([np.array(cov) for cov in coverage], axis=0)
-                total_depth = np.sum(total_depth_per_position)
-                # Depth coverage is average depth across the reference
-                depth_coverage = total_depth / ref_length if ref_length > 0 else 0
-                # Breadth coverage: percentage of positions with at least one read
-                covered_positions = np.sum(total_depth_per_position >= 1)
-                breadth_coverage = (covered_positions / ref_length) * 100 if ref_length > 0 else 0
-                read_count = bam.count(ref)  # Count reads mapping to this reference
-                coverage_data[ref] = {
-                    "depth": depth_coverage,
-                    "breadth": breadth_coverage,
-                    "read_count": read_count
-                }
-                print(f"Reference: {ref}, Depth Coverage: {depth_coverage:.2f}x, Breadth Coverage: {breadth_coverage:.2f}%, Read Count: {read_count}")
+            self.rules.refresh()
+            if delta is not None:
+                self.coverage.add_delta(delta)
+                # Remote reads never went through the monitor
+                self.depth_monitor.seed(self.coverage)
+            else:
+                self.coverage.add_bam(new_bam)
+            coverage_data = self.coverage.snapshot()
+            for ref, cov in coverage_data.items():
+                if ref == 'unmapped':
+                    continue
+                logger.debug(f"Reference: {ref}, Depth Coverage: {cov['depth']:.2f}x, Breadth Coverage: {cov['breadth']:.2f}%, Read Count: {cov['read_count']}")
                 # Update alert check to use depth coverage if needed
-                self.check_depth_coverage_alert(ref, depth_coverage)
-
-            # add unmapped reads
-            unmapped_count = bam.unmapped
-            coverage_data['unmapped'] = {
-                "depth": 0.0,
-                "breadth": 0.0,
-                "read_count": unmapped_count
-            }
-
-            bam.close()
-
-            with open(self.coverage_file, 'a') as f:
-                for ref, cov in coverage_data.items():
-                    f.write(f"{timestamp},{ref},{cov['depth']},{cov['breadth']},{cov['read_count']}\n")
-            logger.debug(f"Coverage and read counts recorded at {timestamp}")
-
-            # Emit coverage update via Socket.IO
-            socketio.emit('coverage_update', {
-                'projectId': self.config.get('projectId', ''),
-                'timestamp': timestamp,
-                'coverage': coverage_data
-            })
+                self.check_depth_coverage_alert(ref, cov['depth'])
+
+            if not partial:
+                self.record_coverage(timestamp, coverage_data)
+
+            # Changed references go to the project's room, coalesced by the broadcaster
+            self.broadcaster.publish(timestamp, coverage_data, partial)
         except Exception as e:
             logger.error(f"Error calculating coverage: {e}")
+            self.resync_depth_monitor()
+
+    def record_coverage(self, timestamp: str, coverage_data: dict):
+        """Store one coverage row per reference in the project's timeline."""
+        self.timeline.record(timestamp, coverage_data)
+        logger.debug(f"Coverage and read counts recorded at {timestamp}")
+
+    def on_threshold_crossed(self, ref: str, depth_coverage: float):
+        """Alert straight from the worker on the read that crossed a threshold."""
+        self.check_depth_coverage_alert(ref, depth_coverage)
 
     def check_depth_coverage_alert(self, ref: str, depth_coverage: float):
-        """Check if depth coverage exceeds threshold and send alerts."""
-        with open(os.path.join(self.app_loc, 'alertinfo.cfg'), 'r') as f:
-            alertinfo_cfg_data = json.load(f)
-        queries = alertinfo_cfg_data.get("queries", [])
-        device = alertinfo_cfg_data.get("device", "")
-        alert_notif_config = alertinfo_cfg_data.get("alertNotifConfig", {})
-        for query in queries:
-            if ref == query.get("header", ""):
-                threshold = float(query.get("threshold", 0))
-                if depth_coverage >= threshold:
-                    alert_str = f"Alert: {query['name']} depth coverage reached {depth_coverage:.2f}x (threshold: {threshold}x)"
-                    logger.critical(alert_str)
-                    if device:
-                        LinuxNotification.send_notification(device, alert_str)
-                    if alert_notif_config.get("enableEmail", False):
-                        email_config = alert_notif_config.get("emailConfig", {})
-                        if all(key in email_config for key in ["sender", "recipient", "smtpServer", "smtpPort", "password"]):
-                            send_email("nanoCAS Alert", alert_str, email_config)
-                        else:
-                            logger.error("Email configuration is incomplete.")
-                    if alert_notif_config.get("enableSMS", False):
-                        sms_recipient = alert_notif_config.get("smsRecipient", "")
-                        if sms_recipient:
-                            send_sms(alert_str, sms_recipient)
-                        else:
-                            logger.error("SMS recipient phone number is missing.")
-
-    def get_existing_files(self, directory):
-        """Get list of existing files of the specified type, sorted by modification time."""
-        if self.file_type == 'FASTQ':
-            extensions = ('.fastq', '.fasta', '.fastq.gz', '.fq.gz')
-        elif self.file_type == 'BAM':
-            extensions = ('.bam',)
-        else:
-            return []
+        """Send alerts for thresholds (or escalation levels) that depth coverage has newly reached."""
+        for query in self.rules.rules_for(ref):
+            level = self.alert_state.evaluate(ref, query, depth_coverage)
+            if level is None:
+                continue
+            threshold = float(query.get("threshold", 0))
+            alert_str = f"Alert: {query['name']} depth coverage reached {depth_coverage:.2f}x (threshold: {threshold}x)"
+            if level > 0:
+                alert_str += f", escalation level {level}"
+            logger.critical(alert_str)
+            self.dispatch_alert(alert_str)
 
-        files = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(extensions)]
-        with self.processed_files_lock:
-            files = [f for f in files if f not in self.processed_files]
-        # Sort by modification time
-        files.sort(key=lambda x: os.path.getctime(x))
-        return files
+    def dispatch_alert(self, alert_str: str):
+        """Hand the alert to the background dispatcher, one delivery per enabled channel."""
+        dispatcher = get_dispatcher()
+        device = self.rules.device
+        alert_notif_config = self.rules.alert_notif_config
+        if device:
+            dispatcher.submit(f"MinKNOW notification to {device}",
+                              lambda: LinuxNotification.send_notification(device, alert_str))
+        if alert_notif_config.get("enableEmail", False):
+            email_config = alert_notif_config.get("emailConfig", {})
+            if all(key in email_config for key in ["sender", "recipient", "smtpServer", "smtpPort", "password"]):
+                dispatcher.submit(f"email to {email_config['recipient']}",
+                                  lambda: send_email("nanoCAS Alert", alert_str, email_config))
+            else:
+                logger.error("Email configuration is incomplete.")
+        if alert_notif_config.get("enableSMS", False):
+            sms_recipient = alert_notif_config.get("smsRecipient", "")
+            if sms_recipient:
+                dispatcher.submit(f"SMS to {sms_recipient}", lambda: send_sms(alert_str, sms_recipient))
+            else:
+                logger.error("SMS recipient phone number is missing.")
 
     def process_existing_files(self, directory):
-        """Process existing files in the directory before starting the observer."""
-        files = self.get_existing_files(directory)
-        for file in files:
-            mtime = os.path.getmtime(file)
-            timestamp = datetime.datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S")
-            if self.file_type == 'FASTQ':
-                self.process_fastq_file(file, timestamp)
-            elif self.file_type == 'BAM':
-                self.process_bam_file(file, timestamp)
-            with self.processed_files_lock:
-                self.processed_files.add(file)
-                with open(self.processed_files_path, 'a') as f:
-                    f.write(file + '\n')
\ No newline at end of file
+        """Queue files already in the directory ahead of live events, oldest first."""
+        self.ingest.scan(directory)
+
+    def close(self):
+        """Release resources held for this project."""
+        self.ingest.close()
+        self.workers.shutdown(wait=True)
+        self.commit_queue.put(None)
+        self.committer.join()
+        self.write_checkpoint()
+        self.ledger.close()
+        with self.aligner_lock:
+            if self.aligner is not None:
+                self.aligner.close()
+                self.aligner = None
+        self.alignments.close()
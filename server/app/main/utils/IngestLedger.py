@@ -0,0 +1,199 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from threading import Lock
+
+logger = logging.getLogger('nanocas')
+
+# Ledger entries are committed (and fsynced) in batches of this many files, or after this many seconds
+LEDGER_BATCH = int(os.getenv('NANOCAS_LEDGER_BATCH', 64))
+LEDGER_SYNC_INTERVAL = float(os.getenv('NANOCAS_LEDGER_SYNC_INTERVAL', 5))
+
+# Bytes at the start of a file fingerprinted when it is processed, to tell an append from a rewrite
+HEAD_BYTES = 64 * 1024
+# Fingerprint of entries whose start is unknown, which match any content
+EMPTY_HEAD = hashlib.blake2b(b'', digest_size=16).hexdigest()
+
+# One row per processed version of a file; seq never goes backwards, so truncate() can trust it
+FILES_COLUMNS = ('seq INTEGER PRIMARY KEY AUTOINCREMENT, dev INTEGER NOT NULL, ino INTEGER NOT NULL, '
+                 'size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, path TEXT NOT NULL, '
+                 'head_len INTEGER NOT NULL, head TEXT NOT NULL, UNIQUE (dev, ino, size, mtime_ns)')
+
+
+def file_key(stat: os.stat_result) -> tuple:
+    """Identity of a file's contents: a rewritten or replaced file gets a new key."""
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def head_digest(path: str, length: int) -> str:
+    """Fingerprint of the first length bytes of path."""
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(length), digest_size=16).hexdigest()
+
+
+class IngestLedger:
+    """Input files a project has processed, in SQLite keyed by (device, inode, size, mtime).
+
+    A file whose key changed since it was processed is told apart by its
+    size and a fingerprint of its first bytes: if it shrank or its start
+    differs it was rewritten and is ingested as a new file; if it only grew
+    it was appended to, which is logged and not ingested again, as its
+    earlier reads are already counted. The path of each entry lets a
+    deleted file be forgotten, so a new file that reuses its inode is
+    ingested too.
+
+    Replaces processed_files.txt, which is imported the first time the
+    ledger is opened and left in place. Entries are numbered in the order
+    they were added, so a checkpoint can record how far the ledger went and
+    truncate() can roll it back to that point.
+    """
+
+    def __init__(self, db_path: str, batch: int = LEDGER_BATCH, sync_interval: float = LEDGER_SYNC_INTERVAL):
+        self.db_path = db_path
+        self.batch = batch
+        self.sync_interval = sync_interval
+        self.lock = Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=FULL')
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(files)')]
+        if columns and 'head' not in columns:
+            self._migrate(columns)
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS files ({FILES_COLUMNS})')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS files_path ON files (path)')
+        self.conn.commit()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def _migrate(self, columns: list):
+        """Bring a ledger written by an earlier version up to the current columns.
+
+        Its entries get an empty fingerprint, so for them only a shrink
+        counts as a rewrite.
+        """
+        path = 'path' if 'path' in columns else "''"
+        self.conn.execute('ALTER TABLE files RENAME TO files_old')
+        self.conn.execute(f'CREATE TABLE files ({FILES_COLUMNS})')
+        self.conn.execute(f'''
+            INSERT OR IGNORE INTO files (seq, dev, ino, size, mtime_ns, path, head_len, head)
+            SELECT seq, dev, ino, size, mtime_ns, {path}, 0, ? FROM files_old ORDER BY seq''',
+                          (EMPTY_HEAD,))
+        self.conn.execute('DROP TABLE files_old')
+        self.conn.commit()
+        logger.debug(f"Migrated {self.db_path} to the current ledger columns")
+
+    @classmethod
+    def open(cls, project_dir: str):
+        """Open the ledger in project_dir, importing a legacy processed_files.txt the first time."""
+        db_path = os.path.join(project_dir, 'ingest_ledger.db')
+        text_path = os.path.join(project_dir, 'processed_files.txt')
+        is_new = not os.path.exists(db_path)
+        ledger = cls(db_path)
+        if is_new and os.path.exists(text_path):
+            ledger.import_text(text_path)
+        return ledger
+
+    def import_text(self, text_path: str):
+        """Add the files listed in a legacy processed_files.txt that still exist, keyed as they are now."""
+        count = 0
+        with open(text_path, 'r') as f:
+            for line in f:
+                path = line.rstrip('\n')
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                self.add(stat, path)
+                count += 1
+        self.flush()
+        logger.debug(f"Imported {count} processed files from {text_path}")
+
+    def seen(self, path: str, stat: os.stat_result) -> bool:
+        """Whether the file at path (as stat) is already counted: unchanged, or only appended to since."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT seq, size, mtime_ns, head_len, head FROM files WHERE dev = ? AND ino = ? '
+                'ORDER BY seq DESC LIMIT 1', file_key(stat)[:2]).fetchone()
+        if row is None:
+            return False
+        seq, size, mtime_ns, head_len, head = row
+        if (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+            return True
+        if stat.st_size < size:
+            logger.info(f"{path} shrank from {size} to {stat.st_size} bytes since it was processed, "
+                        f"ingesting it as a new file")
+            return False
+        try:
+            if head_digest(path, head_len) != head:
+                logger.info(f"{path} was rewritten since it was processed, ingesting it as a new file")
+                return False
+        except OSError:
+            return False
+        if stat.st_size > size:
+            logger.warning(f"{path} grew from {size} to {stat.st_size} bytes after it was processed; "
+                           f"reads appended to a processed file are not ingested")
+        # Remember the change so it is reported once
+        with self.lock:
+            self.conn.execute('UPDATE OR IGNORE files SET size = ?, mtime_ns = ? WHERE seq = ?',
+                              (stat.st_size, stat.st_mtime_ns, seq))
+            self._written()
+        return True
+
+    def add(self, stat: os.stat_result, path: str):
+        """Record a processed file. It counts at once; the write is synced with its batch."""
+        head_len = min(stat.st_size, HEAD_BYTES)
+        try:
+            head = head_digest(path, head_len)
+        except OSError:
+            # Gone already; without a fingerprint only a shrink will count as a rewrite
+            head_len, head = 0, EMPTY_HEAD
+        with self.lock:
+            self.conn.execute('INSERT OR IGNORE INTO files (dev, ino, size, mtime_ns, path, head_len, head) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?)', (*file_key(stat), path, head_len, head))
+            self._written()
+
+    def forget(self, path: str):
+        """Drop the entries of a deleted file, so a new file that reuses its inode is ingested."""
+        with self.lock:
+            if self.conn.execute('DELETE FROM files WHERE path = ?', (path,)).rowcount:
+                self._written()
+
+    def move(self, src_path: str, dest_path: str):
+        """Follow a processed file to its new path."""
+        with self.lock:
+            if self.conn.execute('UPDATE files SET path = ? WHERE path = ?', (dest_path, src_path)).rowcount:
+                self._written()
+
+    def flush(self) -> int:
+        """Sync pending entries and return the sequence number of the last one."""
+        with self.lock:
+            self._commit()
+            return self.conn.execute('SELECT COALESCE(MAX(seq), 0) FROM files').fetchone()[0]
+
+    def truncate(self, seq: int) -> int:
+        """Forget entries added after seq, returning how many were removed."""
+        with self.lock:
+            removed = self.conn.execute('DELETE FROM files WHERE seq > ?', (seq,)).rowcount
+            self._commit()
+        return removed
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def _written(self):
+        self.uncommitted += 1
+        if self.uncommitted >= self.batch or time.monotonic() - self.last_commit >= self.sync_interval:
+            self._commit()
+
+    def _commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            self.conn.close()
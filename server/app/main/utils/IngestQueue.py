@@ -0,0 +1,111 @@
+import logging
+import os
+import time
+from dataclasses import dataclass
+from threading import Condition, Thread
+
+logger = logging.getLogger('nanocas')
+
+
+@dataclass
+class PendingFile:
+    first_seen: float
+    next_check: float
+    size: int = None
+    mtime: float = None
+    closed: bool = False
+
+
+class IngestQueue:
+    """Per-project queue that turns file events into one ordered stream of ready files.
+
+    Events are coalesced by path. A file is ready once the OS reports it was
+    closed after writing, or its size and mtime stop changing for
+    `stable_interval` seconds. Readiness is checked by a single scheduler
+    thread, so no thread sleeps per file. Ready files are handed to
+    `on_ready(path, stat)` in the order they were first seen.
+    """
+
+    def __init__(self, on_ready, accepts=None, stable_interval: float = 1.0, timeout: float = 60.0):
+        self.on_ready = on_ready
+        self.accepts = accepts or (lambda path: True)
+        self.stable_interval = stable_interval
+        self.timeout = timeout
+        self.pending = {}
+        self.cond = Condition()
+        self.stopped = False
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def push(self, path: str, closed: bool = False):
+        """Record an event for path; repeated events for the same path are merged."""
+        if not self.accepts(path):
+            return
+        with self.cond:
+            entry = self.pending.get(path)
+            if entry is None:
+                now = time.monotonic()
+                entry = self.pending[path] = PendingFile(first_seen=now, next_check=now)
+            entry.closed = entry.closed or closed
+            self.cond.notify()
+
+    def discard(self, path: str):
+        with self.cond:
+            self.pending.pop(path, None)
+
+    def scan(self, directory: str):
+        """Queue files already present in directory, oldest first."""
+        files = [os.path.join(directory, f) for f in os.listdir(directory)]
+        files = [f for f in files if os.path.isfile(f) and self.accepts(f)]
+        files.sort(key=lambda x: os.path.getmtime(x))
+        for path in files:
+            self.push(path)
+
+    def _poll(self, now: float):
+        """Collect ready files and the delay until the next stability check."""
+        ready = []
+        delay = None
+        for path, entry in list(self.pending.items()):
+            if not entry.closed and now < entry.next_check:
+                wait = entry.next_check - now
+                delay = wait if delay is None else min(delay, wait)
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                logger.error(f"File {path} no longer exists.")
+                del self.pending[path]
+                continue
+            if entry.closed or (stat.st_size, stat.st_mtime) == (entry.size, entry.mtime):
+                ready.append((path, stat))
+                del self.pending[path]
+                continue
+            if now - entry.first_seen > self.timeout:
+                logger.warning(f"File {path} did not stabilize within {self.timeout} seconds.")
+                del self.pending[path]
+                continue
+            entry.size, entry.mtime = stat.st_size, stat.st_mtime
+            entry.next_check = now + self.stable_interval
+            delay = self.stable_interval if delay is None else min(delay, self.stable_interval)
+        return ready, delay
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if self.stopped:
+                    return
+                ready, delay = self._poll(time.monotonic())
+                if not ready:
+                    self.cond.wait(timeout=delay)
+                    continue
+            for path, stat in ready:
+                try:
+                    self.on_ready(path, stat)
+                except Exception as e:
+                    logger.error(f"Error queueing file {path}: {e}")
+
+    def close(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.thread.join()
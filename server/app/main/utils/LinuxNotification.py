@@ -1,46 +1,157 @@
-
+import os
 import subprocess
+import time
 from dataclasses import dataclass
+from threading import Lock
 from minknow_api.manager import Manager
 import logging
 
 logger = logging.getLogger('nanocas')
 
+# Seconds a MinKNOW flow cell position listing is reused before it is enumerated again
+DEVICE_TTL = float(os.getenv('NANOCAS_DEVICE_TTL', 30))
+
+_registry = None
+_registry_lock = Lock()
+
+
+class DeviceRegistry:
+    """Flow cell positions known to MinKNOW, with one open connection per position.
+
+    The position list is re-enumerated at most every ttl seconds, and once
+    more when an unknown device is asked for; a device still missing then is
+    not looked for again until the next listing. Connections are kept until
+    their device disappears or a call on them fails. manager_factory(host,
+    port) can return a fake with a flow_cell_positions() method for tests.
+    """
+
+    def __init__(self, host="127.0.0.1", port=None, ttl: float = DEVICE_TTL, manager_factory=None):
+        self.host = host
+        self.port = port
+        self.ttl = ttl
+        self.manager_factory = manager_factory or (lambda host, port: Manager(host=host, port=port))
+        self.manager = None
+        self.positions = {}
+        self.refreshed_at = None
+        self.missing = set()  # Asked for but absent from the current listing
+        self.connections = {}
+        self.announced = set()
+        self.lock = Lock()
+
+    def devices(self, refresh: bool = False) -> list:
+        with self.lock:
+            if refresh or self._expired():
+                self._refresh()
+            return list(self.positions.values())
+
+    def _expired(self) -> bool:
+        return self.refreshed_at is None or time.monotonic() - self.refreshed_at > self.ttl
+
+    def _refresh(self):
+        try:
+            if self.manager is None:
+                self.manager = self.manager_factory(self.host, self.port)
+            positions = {position.name: position for position in self.manager.flow_cell_positions()}
+        except Exception as e:
+            logger.error(f"Error listing MinKNOW devices: {e}")
+            self.manager = None
+            positions = {}
+        for name in set(self.connections) - set(positions):
+            del self.connections[name]
+        self.positions = positions
+        self.missing.clear()
+        self.refreshed_at = time.monotonic()
+
+    def get(self, device_name):
+        with self.lock:
+            if self._expired():
+                self._refresh()
+            elif device_name not in self.positions and device_name not in self.missing:
+                # Possibly connected since the last listing
+                self._refresh()
+            if device_name not in self.positions:
+                self.missing.add(device_name)
+            return self.positions.get(device_name)
+
+    def connection(self, device_name):
+        """Open connection to a device, reused across calls; None if MinKNOW doesn't know it."""
+        position = self.get(device_name)
+        if position is None:
+            return None
+        with self.lock:
+            connection = self.connections.get(device_name)
+            if connection is None:
+                connection = self.connections[device_name] = position.connect()
+                logger.debug(f"Connected to device {device_name}")
+            return connection
+
+    def drop(self, device_name):
+        """Forget a connection that failed, so the next call reconnects."""
+        with self.lock:
+            self.connections.pop(device_name, None)
+
+    def newly_seen(self, device_names) -> list:
+        """Names not returned by an earlier call, e.g. to greet new devices once."""
+        with self.lock:
+            new = [name for name in device_names if name not in self.announced]
+            self.announced.update(new)
+        return new
+
+
+def get_registry() -> DeviceRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = DeviceRegistry()
+        return _registry
+
+
+def set_registry(registry: DeviceRegistry):
+    """Replace the process-wide registry, e.g. with one built on a fake Manager."""
+    global _registry
+    with _registry_lock:
+        _registry = registry
+
+
 @dataclass
 class LinuxNotification():
-    
-    def index_devices(host="127.0.0.1", port=None):
-        device_index = []
-        try:
-            manager = Manager(host=host, port=port)
-            device_index = [position for position in manager.flow_cell_positions()]
-        except:
-            pass
-        return device_index
-        
-
-    def get_device(device_name, host="127.0.0.1", port=None):
-        for device in LinuxNotification.index_devices(host, port):
-            if device.name == device_name:
-                print(type(device))
-                return device
-        logger.error(f"Error: Could not find device {device_name}")
-        return None
+
+    def index_devices(refresh=False):
+        return get_registry().devices(refresh=refresh)
+
+
+    def get_device(device_name):
+        device = get_registry().get(device_name)
+        if device is None:
+            logger.error(f"Error: Could not find device {device_name}")
+        return device
 
     def test_connection( device_name, msg="This is a linux test connection"):
-        LinuxNotification.send_notification(msg)
-        pass
+        return LinuxNotification.send_notification(device_name, msg)
 
     def send_notification(device_name, msg, severity=2):
-        device = LinuxNotification.get_device(device_name)
-        if device is None:
+        registry = get_registry()
+        try:
+            connection_address = registry.connection(device_name)
+        except Exception as e:
+            logger.error(f"Cannot connect to device {device_name}: {e}")
+            return False
+        if connection_address is None:
             logger.error(f"Cannot send notification: device {device_name} not found")
-            return
-        connection_address = device.connect()
+            return False
         try:
             subprocess.Popen(['notify-send', msg])
         except:
             logger.error("Error: unable to send linux notification, are you running nanocas on linux?")
-        connection_address.log.send_user_message(severity=severity, user_message=msg)
-        logger.debug(connection_address.device.get_device_state())
-
+        try:
+            connection_address.log.send_user_message(severity=severity, user_message=msg)
+        except Exception as e:
+            logger.error(f"Error sending notification to device {device_name}: {e}")
+            registry.drop(device_name)
+            return False
+        if logger.isEnabledFor(logging.DEBUG):
+            try:
+                logger.debug(connection_address.device.get_device_state())
+            except Exception as e:
+                logger.debug(f"Could not read state of device {device_name}: {e}")
+        return True
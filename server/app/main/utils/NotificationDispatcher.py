@@ -0,0 +1,84 @@
+import heapq
+import itertools
+import logging
+import os
+import time
+from threading import Condition, Lock, Thread
+
+logger = logging.getLogger('nanocas')
+
+# Attempts per delivery before it is dropped, and the delay before the first retry (doubled each time)
+MAX_ATTEMPTS = int(os.getenv('NANOCAS_NOTIFY_ATTEMPTS', 4))
+RETRY_DELAY = float(os.getenv('NANOCAS_NOTIFY_RETRY_DELAY', 2.0))
+
+_dispatcher = None
+_dispatcher_lock = Lock()
+
+
+class NotificationDispatcher:
+    """Delivers alert notifications on a background thread, retrying failures with backoff.
+
+    A delivery is a callable that returns False (or raises) on a failure worth
+    retrying. Each delivery is retried on its own schedule, so a failing
+    channel holds up neither the caller nor the other channels of an alert.
+    """
+
+    def __init__(self, max_attempts: int = MAX_ATTEMPTS, retry_delay: float = RETRY_DELAY):
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.pending = []  # heap of (due, seq, name, send, attempt)
+        self.seq = itertools.count()
+        self.cond = Condition()
+        self.closed = False
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, name: str, send):
+        """Queue send() for delivery; name identifies it in the logs."""
+        self._schedule(time.monotonic(), name, send, 1)
+
+    def _schedule(self, due: float, name: str, send, attempt: int):
+        with self.cond:
+            heapq.heappush(self.pending, (due, next(self.seq), name, send, attempt))
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.closed and (not self.pending or self.pending[0][0] > time.monotonic()):
+                    timeout = self.pending[0][0] - time.monotonic() if self.pending else None
+                    self.cond.wait(timeout)
+                if self.closed and not self.pending:
+                    return
+                due, _, name, send, attempt = heapq.heappop(self.pending)
+            try:
+                delivered = send() is not False
+            except Exception as e:
+                logger.error(f"Error delivering {name}: {e}")
+                delivered = False
+            if delivered:
+                continue
+            if attempt >= self.max_attempts or self.closed:
+                logger.error(f"Giving up on {name} after {attempt} attempts")
+                continue
+            delay = self.retry_delay * 2 ** (attempt - 1)
+            logger.warning(f"Delivering {name} failed (attempt {attempt}), retrying in {delay:.0f}s")
+            self._schedule(time.monotonic() + delay, name, send, attempt + 1)
+
+    def close(self):
+        """Deliver what is queued once, dropping pending retries, and stop the thread."""
+        with self.cond:
+            self.closed = True
+            self.pending = [item for item in self.pending if item[4] == 1]
+            heapq.heapify(self.pending)
+            self.cond.notify()
+        self.thread.join()
+
+
+def get_dispatcher() -> NotificationDispatcher:
+    """Process-wide dispatcher, started on first use."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher()
+        return _dispatcher
@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger('nanocas')
+
+CHECKPOINT_VERSION = 2
+
+
+class ProjectCheckpoint:
+    """Atomic snapshot of a project's processing state (checkpoint.npz).
+
+    Holds the coverage depth arrays, the alert state and how far the ingest
+    ledger and shard store had got (the sequence numbers of the last
+    processed file and of the last shard whose reads are counted), so a
+    restarted FileHandler can resume without re-reading its shards. The
+    file is replaced atomically; a missing or corrupt one loads as None and
+    the caller rebuilds instead.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, coverage: dict, ledger_seq: int, alert_state: dict, shard_seq: int):
+        """Save coverage (from CoverageAccumulator.state()) and the rest of the state, replacing the last checkpoint."""
+        meta = {
+            'version': CHECKPOINT_VERSION,
+            'references': coverage['references'],
+            'read_counts': coverage['read_counts'],
+            'unmapped': coverage['unmapped'],
+            'ledger_seq': ledger_seq,
+            'alert_state': alert_state,
+            'shard_seq': shard_seq
+        }
+        arrays = {f'depth_{i}': coverage['depth'][name] for i, (name, _) in enumerate(coverage['references'])}
+        arrays['meta'] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        # Make the rename itself durable
+        dir_fd = os.open(os.path.dirname(self.path) or '.', os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def load(self) -> dict | None:
+        """The last checkpoint with its coverage in CoverageAccumulator.state() form, or None."""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                meta = json.loads(data['meta'].tobytes().decode())
+                if meta.get('version') != CHECKPOINT_VERSION:
+                    raise ValueError(f"unsupported version {meta.get('version')}")
+                depth = {name: data[f'depth_{i}'] for i, (name, _) in enumerate(meta['references'])}
+        except Exception as e:
+            logger.error(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+        return {
+            'coverage': {
+                'references': meta['references'],
+                'depth': depth,
+                'read_counts': meta['read_counts'],
+                'unmapped': meta['unmapped']
+            },
+            'ledger_seq': meta['ledger_seq'],
+            'alert_state': meta['alert_state'],
+            'shard_seq': meta['shard_seq']
+        }
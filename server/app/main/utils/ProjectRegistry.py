@@ -0,0 +1,111 @@
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from threading import Lock
+
+logger = logging.getLogger('nanocas')
+
+_registries = {}
+_registries_lock = Lock()
+
+
+class ProjectRegistry:
+    """Projects known to nanocas, in SQLite keyed by project id and MinION directory.
+
+    Replaces the tab-separated ~/.nanocas/.cache file, which is imported the
+    first time the registry is opened and left in place.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS projects (
+                id TEXT PRIMARY KEY,
+                minion_dir TEXT NOT NULL UNIQUE,
+                nanocas_dir TEXT NOT NULL,
+                created REAL NOT NULL
+            )''')
+        self.conn.commit()
+
+    @classmethod
+    def open(cls, nanocas_dir: str):
+        """Open the registry in nanocas_dir, importing a legacy .cache file the first time."""
+        os.makedirs(nanocas_dir, exist_ok=True)
+        db_path = os.path.join(nanocas_dir, 'projects.db')
+        cache_path = os.path.join(nanocas_dir, '.cache')
+        is_new = not os.path.exists(db_path)
+        registry = cls(db_path)
+        if is_new and os.path.exists(cache_path):
+            registry.import_cache(cache_path)
+        return registry
+
+    @property
+    def paths(self) -> list:
+        """Files whose state versions the registry, for conditional responses."""
+        return [self.db_path, self.db_path + '-wal']
+
+    def import_cache(self, cache_path: str):
+        """Load uid, MinION directory and project directory rows from a legacy .cache file."""
+        rows = []
+        with open(cache_path, 'r') as cache_fs:
+            for line in cache_fs:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 3:
+                    continue
+                rows.append((parts[0], parts[1], parts[2].rstrip(), time.time()))
+        with self.lock:
+            # Later duplicates of a MinION directory were never reachable through get_uid
+            self.conn.executemany('INSERT OR IGNORE INTO projects VALUES (?, ?, ?, ?)', rows)
+            self.conn.commit()
+        logger.debug(f"Imported {len(rows)} projects from {cache_path}")
+
+    def register(self, minion_dir: str, nanocas_dir: str) -> str:
+        """Id of the project watching minion_dir, creating one under nanocas_dir if there is none."""
+        uid = str(uuid.uuid4())
+        with self.lock:
+            self.conn.execute('INSERT OR IGNORE INTO projects VALUES (?, ?, ?, ?)',
+                              (uid, minion_dir, os.path.join(nanocas_dir, uid), time.time()))
+            self.conn.commit()
+            row = self.conn.execute('SELECT id FROM projects WHERE minion_dir = ?', (minion_dir,)).fetchone()
+        return row[0]
+
+    def get(self, uid: str) -> dict | None:
+        with self.lock:
+            row = self.conn.execute('SELECT id, minion_dir, nanocas_dir FROM projects WHERE id = ?',
+                                    (uid,)).fetchone()
+        if row is None:
+            return None
+        return {'id': row[0], 'minion_dir': row[1], 'nanocas_dir': row[2]}
+
+    def all(self) -> list:
+        with self.lock:
+            rows = self.conn.execute('SELECT id, minion_dir, nanocas_dir FROM projects ORDER BY created').fetchall()
+        return [{'id': uid, 'minion_dir': minion_dir, 'nanocas_dir': nanocas_dir}
+                for uid, minion_dir, nanocas_dir in rows]
+
+    def remove(self, uid: str) -> bool:
+        """Forget a project. Returns False if it wasn't registered."""
+        with self.lock:
+            removed = self.conn.execute('DELETE FROM projects WHERE id = ?', (uid,)).rowcount
+            self.conn.commit()
+        return removed > 0
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def get_projects(nanocas_dir: str) -> ProjectRegistry:
+    """Shared project registry for a nanocas directory, opened on first use."""
+    key = os.path.normpath(nanocas_dir)
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = _registries[key] = ProjectRegistry.open(key)
+        return registry
@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+
+import pysam
+
+try:
+    import mappy
+except ImportError:  # fall back to the minimap2 command line
+    mappy = None
+
+logger = logging.getLogger('nanocas')
+
+COMPLEMENT = str.maketrans('ACGTNacgtn', 'TGCANtgcan')
+
+
+class ResidentAligner:
+    """minimap2 aligner that keeps a project's .mmi index loaded in memory.
+
+    The index is read once when the aligner is created and reused for every
+    file until close() is called.
+    """
+
+    def __init__(self, index_file: str, preset: str = 'map-ont'):
+        if mappy is None:
+            raise RuntimeError("mappy is not installed")
+        self.index_file = index_file
+        self.aligner = mappy.Aligner(fn_idx_in=index_file, preset=preset)
+        if not self.aligner:
+            raise RuntimeError(f"Failed to load index {index_file}")
+        names = list(self.aligner.seq_names)
+        self.header = pysam.AlignmentHeader.from_dict({
+            'HD': {'VN': '1.6', 'SO': 'unsorted'},
+            'SQ': [{'SN': name, 'LN': len(self.aligner.seq(name))} for name in names]
+        })
+        self.ref_ids = {name: i for i, name in enumerate(names)}
+        self._local = threading.local()
+        logger.debug(f"Loaded minimap2 index {index_file} with {len(names)} references")
+
+    @staticmethod
+    def available() -> bool:
+        return mappy is not None
+
+    def _buffer(self):
+        # mappy needs one ThreadBuffer per thread when the aligner is shared
+        if not hasattr(self._local, 'buf'):
+            self._local.buf = mappy.ThreadBuffer()
+        return self._local.buf
+
+    def map_read(self, name: str, seq: str, qual: str = None) -> list:
+        """Align one read and return its records as pysam AlignedSegments."""
+        hits = list(self.aligner.map(seq, buf=self._buffer()))
+        if not hits:
+            segment = self._segment(name, seq, qual)
+            segment.flag = 4
+            segment.reference_id = -1
+            segment.reference_start = -1
+            return [segment]
+
+        segments = []
+        seen_primary = False
+        for hit in hits:
+            reverse = hit.strand < 0
+            segment = self._segment(name, self._revcomp(seq) if reverse else seq,
+                                    qual[::-1] if (reverse and qual) else qual)
+            flag = 16 if reverse else 0
+            if not hit.is_primary:
+                flag |= 256
+            elif seen_primary:
+                flag |= 2048
+            seen_primary = seen_primary or hit.is_primary
+            segment.flag = flag
+            segment.reference_id = self.ref_ids[hit.ctg]
+            segment.reference_start = hit.r_st
+            segment.mapping_quality = hit.mapq
+            left, right = (len(seq) - hit.q_en, hit.q_st) if reverse else (hit.q_st, len(seq) - hit.q_en)
+            cigar = [(op, length) for length, op in hit.cigar]
+            if left:
+                cigar.insert(0, (4, left))
+            if right:
+                cigar.append((4, right))
+            segment.cigartuples = cigar
+            segment.set_tag('NM', hit.NM)
+            segments.append(segment)
+        return segments
+
+    def _segment(self, name, seq, qual):
+        segment = pysam.AlignedSegment(self.header)
+        segment.query_name = name
+        segment.query_sequence = seq
+        if qual:
+            segment.query_qualities = pysam.qualitystring_to_array(qual)
+        return segment
+
+    @staticmethod
+    def _revcomp(seq: str) -> str:
+        return seq.translate(COMPLEMENT)[::-1]
+
+    def map_reads(self, reads):
+        """Yield the alignments of (name, seq, qual) reads."""
+        for name, seq, qual in reads:
+            yield from self.map_read(name, seq, qual)
+
+    def align_reads(self, reads, output_bam: str, on_segment=None):
+        """Align (name, seq, qual) reads into a coordinate-sorted BAM.
+
+        on_segment, if given, sees every alignment as soon as it is produced.
+        """
+        unsorted_bam = output_bam + '.unsorted'
+        with pysam.AlignmentFile(unsorted_bam, 'wb', header=self.header) as out:
+            for segment in self.map_reads(reads):
+                if on_segment is not None:
+                    on_segment(segment)
+                out.write(segment)
+        pysam.sort('-o', output_bam, unsorted_bam)
+        os.remove(unsorted_bam)
+
+    def close(self):
+        """Drop the loaded index."""
+        self.aligner = None
+        logger.debug(f"Released minimap2 index {self.index_file}")
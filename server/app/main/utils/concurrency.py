@@ -0,0 +1,57 @@
+import logging
+import os
+import queue
+
+from app import ASYNC_MODE, socketio
+
+logger = logging.getLogger('nanocas')
+
+# Native threads for blocking calls made from handlers when serving on eventlet or gevent
+BLOCKING_WORKERS = int(os.getenv('NANOCAS_BLOCKING_WORKERS', 20))
+
+# Tasks handed to the server by pipeline threads; a native queue, as threading is never monkey-patched
+_handoff = queue.Queue()
+
+
+def run_blocking(fn, *args, **kwargs):
+    """Call fn in a native thread and wait for its result without stalling the event loop.
+
+    With the threading server every handler already has its own thread, so
+    fn is just called.
+    """
+    if ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args, **kwargs)
+    if ASYNC_MODE == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
+
+
+def call_soon(fn, *args):
+    """Run fn(*args) as a background task of the server. Safe to call from any thread."""
+    if ASYNC_MODE in ('eventlet', 'gevent'):
+        _handoff.put((fn, args))
+    else:
+        socketio.start_background_task(fn, *args)
+
+
+def _run_handoff():
+    while True:
+        fn, args = run_blocking(_handoff.get)
+        socketio.start_background_task(fn, *args)
+
+
+def start():
+    """Size the blocking pool and start taking tasks from pipeline threads; call once before serving."""
+    if ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        tpool.set_num_threads(BLOCKING_WORKERS)
+    elif ASYNC_MODE == 'gevent':
+        import gevent
+        gevent.get_hub().threadpool.maxsize = BLOCKING_WORKERS
+    else:
+        return
+    # The hand-off loop keeps one of the pool's threads waiting on the queue
+    socketio.start_background_task(_run_handoff)
+    logger.debug(f"Serving on {ASYNC_MODE} with {BLOCKING_WORKERS} threads for blocking work")
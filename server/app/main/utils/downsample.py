@@ -0,0 +1,33 @@
+import numpy as np
+
+
+def lttb(x, y, max_points: int) -> list:
+    """Indices of the points kept by Largest-Triangle-Three-Buckets downsampling.
+
+    Keeps the first and last points and, from each of the max_points - 2
+    buckets in between, the point forming the largest triangle with the point
+    kept before it and the average of the next bucket. This preserves peaks
+    and steps that plain striding would drop.
+    """
+    n = len(x)
+    if max_points >= n:
+        return list(range(n))
+    if max_points < 3:
+        return [0, n - 1][-max_points:] if max_points > 0 else []
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    kept = [0]
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        a = kept[-1]
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        kept.append(start + int(np.argmax(area)))
+    kept.append(n - 1)
+    return kept
@@ -1,29 +1,173 @@
+import os
 import smtplib
 from email.mime.text import MIMEText
+from threading import Lock, Timer
 import logging
 
+from .NotificationDispatcher import get_dispatcher
+
 logger = logging.getLogger("nanocas")
 
-def send_email(subject, body, config):
-    try:
-        sender = config["sender"]
-        password = config["password"]
-        recipient = config["recipient"]
-        smtp_server = config["smtp_server"]
-        smtp_port = config["smtp_port"]
+# Seconds an SMTP session may sit unused before it is closed
+SMTP_IDLE_TIMEOUT = float(os.getenv('NANOCAS_SMTP_IDLE_TIMEOUT', 60))
+SMTP_TIMEOUT = float(os.getenv('NANOCAS_SMTP_TIMEOUT', 30))
+# Refuse to log in without STARTTLS; set to false only for local stand-ins such as aiosmtpd
+SMTP_REQUIRE_TLS = os.getenv('NANOCAS_SMTP_REQUIRE_TLS', 'true').lower() == 'true'
+# Seconds to collect alerts into one digest email; 0 sends each alert on its own
+EMAIL_DIGEST_WINDOW = float(os.getenv('NANOCAS_EMAIL_DIGEST_WINDOW', 0))
+
+_sessions = {}
+_sessions_lock = Lock()
+_digests = {}
+_digests_lock = Lock()
+
+
+class SMTPSession:
+    """One logged-in SMTP connection, reused across emails and reopened when it drops or idles out."""
+
+    def __init__(self, host: str, port: int, sender: str, password: str, idle_timeout: float = SMTP_IDLE_TIMEOUT,
+                 require_tls: bool = SMTP_REQUIRE_TLS):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.password = password
+        self.idle_timeout = idle_timeout
+        self.require_tls = require_tls
+        self.lock = Lock()
+        self.server = None
+        self.idle_timer = None
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        try:
+            server.ehlo()
+            # starttls() raises if the server doesn't offer it, so the password never goes out in the clear
+            if self.require_tls or server.has_extn('starttls'):
+                server.starttls()
+                server.ehlo()
+            if self.password and server.has_extn('auth'):
+                server.login(self.sender, self.password)
+        except Exception:
+            server.close()
+            raise
+        logger.debug(f"Connected to SMTP server {self.host}:{self.port}")
+        return server
+
+    def sendmail(self, recipient: str, message: str):
+        with self.lock:
+            if self.idle_timer is not None:
+                self.idle_timer.cancel()
+            try:
+                reused = self.server is not None
+                if not reused:
+                    self.server = self._connect()
+                try:
+                    self.server.sendmail(self.sender, recipient, message)
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    self._quit()
+                    if not reused:
+                        raise
+                    # The server dropped the idle connection; retry once on a fresh one
+                    self.server = self._connect()
+                    self.server.sendmail(self.sender, recipient, message)
+            except Exception:
+                self._quit()
+                raise
+            finally:
+                self.idle_timer = Timer(self.idle_timeout, self.close)
+                self.idle_timer.daemon = True
+                self.idle_timer.start()
+
+    def _quit(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+        self.server = None
+
+    def close(self):
+        with self.lock:
+            if self.idle_timer is not None:
+                self.idle_timer.cancel()
+                self.idle_timer = None
+            self._quit()
+
+
+def get_session(config) -> SMTPSession:
+    """Shared session for the server and sender in an email config."""
+    host = config.get("smtp_server", config.get("smtpServer"))
+    port = int(config.get("smtp_port", config.get("smtpPort")))
+    key = (host, port, config["sender"], config["password"])
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = SMTPSession(host, port, config["sender"], config["password"])
+        return session
+
 
+def close_sessions():
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+def _deliver(session, subject, body, recipient):
+    try:
         msg = MIMEText(body)
         msg["Subject"] = subject
-        msg["From"] = sender
+        msg["From"] = session.sender
         msg["To"] = recipient
-
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            print("Email server connected")
-            server.starttls()
-            server.login(sender, password)
-            server.sendmail(sender, recipient, msg.as_string())
+        session.sendmail(recipient, msg.as_string())
         logger.info(f"Email sent to {recipient}")
-    
+        return True
+
     except Exception as e:
         print(f"Failed to send email: {e}")
-        logger.error(f"Failed to send email: {e}")
\ No newline at end of file
+        logger.error(f"Failed to send email: {e}")
+        return False
+
+
+def _flush_digest(key):
+    with _digests_lock:
+        digest = _digests.pop(key)
+    session, recipient, subject, bodies = digest
+    if len(bodies) > 1:
+        subject = f"{subject} ({len(bodies)} alerts)"
+    body = "\n\n".join(bodies)
+    get_dispatcher().submit(f"email digest to {recipient}", lambda: _deliver(session, subject, body, recipient))
+
+
+def send_email(subject, body, config, digest_window=None):
+    """Email body to config's recipient over a pooled SMTP session.
+
+    With a digest window (seconds, defaulting to config "digestWindow" or
+    NANOCAS_EMAIL_DIGEST_WINDOW), the message is held and merged with every
+    other message to the same recipient in that window, then sent as one
+    email through the notification dispatcher.
+    """
+    try:
+        session = get_session(config)
+        recipient = config["recipient"]
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error(f"Failed to send email, incomplete configuration: {e}")
+        return None
+    if digest_window is None:
+        digest_window = float(config.get("digestWindow", EMAIL_DIGEST_WINDOW))
+    if digest_window <= 0:
+        return _deliver(session, subject, body, recipient)
+
+    key = (session, recipient, subject)
+    with _digests_lock:
+        digest = _digests.get(key)
+        if digest is None:
+            digest = _digests[key] = (session, recipient, subject, [])
+            timer = Timer(digest_window, _flush_digest, (key,))
+            timer.daemon = True
+            timer.start()
+        digest[3].append(body)
+    logger.debug(f"Email to {recipient} held for digest")
+    return True
@@ -0,0 +1,191 @@
+import glob
+import logging
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from threading import Lock, Thread
+
+from . import tasks
+
+logger = logging.getLogger('nanocas')
+
+# 'celery' hands jobs to the Celery workers through Redis; 'local' runs them in a process pool in this server
+EXECUTOR = os.getenv('NANOCAS_EXECUTOR',
+                     'celery' if os.getenv('ENABLE_DISTRIBUTED', 'false').lower() == 'true' else 'local')
+LOCAL_WORKERS = int(os.getenv('NANOCAS_LOCAL_WORKERS', os.cpu_count() or 1))
+
+# Job name -> plain function taking progress(meta) first, and its Celery task (None without celery)
+JOBS = {
+    'download_database': (tasks.download_database_job, getattr(tasks, 'int_download_database', None)),
+    'align_batch': (tasks.align_batch_job, getattr(tasks, 'align_batch', None)),
+}
+
+# Holds the job id of a project's database build, so its progress can be looked up after a reconnect
+DOWNLOAD_TASK_FILE = 'download_task'
+# States after which a build's status won't change; UNKNOWN means no executor remembers the job
+TERMINAL_STATES = ('SUCCESS', 'FAILURE', 'UNKNOWN')
+
+_executor = None
+_executor_lock = Lock()
+
+
+@dataclass
+class JobResult:
+    """Celery-style state (PENDING, PROGRESS, SUCCESS, FAILURE, or UNKNOWN) and info of a job."""
+    state: str
+    info: object = None
+
+
+class CeleryExecutor:
+    """Runs jobs on the Celery workers."""
+
+    def __init__(self):
+        if tasks.celery is None:
+            raise RuntimeError("NANOCAS_EXECUTOR is 'celery' but celery is not installed")
+
+    def submit(self, name: str, *args, **options):
+        """Queue a job, returning a handle with .id and .get(). options go to apply_async."""
+        return JOBS[name][1].apply_async(args=list(args), **options)
+
+    def result(self, job_id: str) -> JobResult:
+        res = tasks.celery.AsyncResult(job_id)
+        return JobResult(res.state, res.info)
+
+    def close(self):
+        pass
+
+
+class LocalJob:
+    def __init__(self, executor, job_id, future):
+        self.executor = executor
+        self.id = job_id
+        self.future = future
+
+    def get(self, timeout=None):
+        """Wait for the job's return value (re-raising its error), then forget the job."""
+        try:
+            return self.future.result(timeout)
+        finally:
+            self.executor.forget(self.id)
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def _run_job(name, job_id, args):
+    def progress(meta):
+        _progress_queue.put((job_id, meta))
+    return JOBS[name][0](progress, *args)
+
+
+class LocalExecutor:
+    """Runs the same jobs in a process pool of this server, with no broker.
+
+    Progress reported by a job is sent back over a queue and kept with its
+    state until the job is forgotten, so result() answers like Celery's.
+    """
+
+    def __init__(self, max_workers: int = LOCAL_WORKERS):
+        context = multiprocessing.get_context('spawn')
+        self.progress_queue = context.Queue()
+        self.pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                        initializer=_init_worker, initargs=(self.progress_queue,))
+        self.jobs = {}
+        self.lock = Lock()
+        self.progress_thread = Thread(target=self._collect_progress, daemon=True)
+        self.progress_thread.start()
+
+    def submit(self, name: str, *args, **options):
+        job_id = str(uuid.uuid4())
+        with self.lock:
+            self.jobs[job_id] = JobResult('PENDING')
+        future = self.pool.submit(_run_job, name, job_id, args)
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return LocalJob(self, job_id, future)
+
+    def _finish(self, job_id, future):
+        error = future.exception()
+        with self.lock:
+            if job_id in self.jobs:
+                if error is not None:
+                    self.jobs[job_id] = JobResult('FAILURE', error)
+                else:
+                    self.jobs[job_id] = JobResult('SUCCESS', future.result())
+
+    def _collect_progress(self):
+        while True:
+            item = self.progress_queue.get()
+            if item is None:
+                return
+            job_id, meta = item
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is not None and job.state in ('PENDING', 'PROGRESS'):
+                    self.jobs[job_id] = JobResult('PROGRESS', meta)
+
+    def result(self, job_id: str) -> JobResult:
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            # Jobs don't outlive the server that ran them
+            return JobResult('UNKNOWN')
+        return job
+
+    def forget(self, job_id: str):
+        with self.lock:
+            self.jobs.pop(job_id, None)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        self.progress_queue.put(None)
+        self.progress_thread.join()
+
+
+def get_executor():
+    """Process-wide executor for the configured backend, started on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = CeleryExecutor() if EXECUTOR == 'celery' else LocalExecutor()
+            logger.debug(f"Using the {EXECUTOR} executor")
+        return _executor
+
+
+def record_download_task(nanocas_location, task_id):
+    with open(os.path.join(nanocas_location, DOWNLOAD_TASK_FILE), 'w') as f:
+        f.write(task_id)
+
+
+def download_status(nanocas_location):
+    """State and latest progress of a project's database build, or None if none was started."""
+    try:
+        with open(os.path.join(nanocas_location, DOWNLOAD_TASK_FILE), 'r') as f:
+            task_id = f.read().strip()
+    except FileNotFoundError:
+        return None
+    res = get_executor().result(task_id)
+    state, info = res.state, res.info
+    # A finished build outlives its job: local jobs are forgotten on restart and expired Celery results read as PENDING
+    if state in ('UNKNOWN', 'PENDING') and glob.glob(os.path.join(nanocas_location, 'database', '*.mmi')):
+        state, info = 'SUCCESS', None
+    status = {'task_id': task_id, 'state': state, 'percent_done': 0, 'status_message': ''}
+    if state == 'PROGRESS' and isinstance(info, dict):
+        status['percent_done'] = info.get('percent-done', 0)
+        status['status_message'] = info.get('message', '')
+    elif state == 'SUCCESS' and info == "ER1":
+        status['state'] = 'FAILURE'
+        status['status_message'] = "Building the index failed."
+    elif state == 'SUCCESS':
+        status['percent_done'] = 100
+        status['status_message'] = "Database successfully downloaded and built."
+    elif state == 'FAILURE':
+        status['status_message'] = str(info)
+    elif state == 'PENDING':
+        status['status_message'] = "Waiting for a worker."
+    elif state == 'UNKNOWN':
+        status['status_message'] = "No record of this build and no index was built; the server may have restarted during it."
+    return status
@@ -0,0 +1,73 @@
+import gzip
+import itertools
+
+
+def open_reads(path: str):
+    """Open a FASTQ/FASTA file for reading text, plain or gzipped."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt')
+    return open(path, 'r')
+
+
+def read_fastx(path: str):
+    """Yield (name, seq, qual) for every record; qual is None for FASTA."""
+    with open_reads(path) as f:
+        line = f.readline()
+        while line:
+            line = line.rstrip('\n')
+            if line.startswith('>'):
+                name = line[1:].split(maxsplit=1)[0] if len(line) > 1 else ''
+                seq = []
+                line = f.readline()
+                while line and not line.startswith('>'):
+                    seq.append(line.strip())
+                    line = f.readline()
+                yield name, ''.join(seq), None
+            elif line.startswith('@'):
+                name = line[1:].split(maxsplit=1)[0] if len(line) > 1 else ''
+                seq = []
+                line = f.readline()
+                while line and not line.startswith('+'):
+                    seq.append(line.strip())
+                    line = f.readline()
+                seq = ''.join(seq)
+                qual = []
+                length = 0
+                while length < len(seq):
+                    line = f.readline()
+                    if not line:
+                        break
+                    qual.append(line.strip())
+                    length += len(qual[-1])
+                yield name, seq, ''.join(qual)
+                line = f.readline()
+            else:
+                line = f.readline()
+
+
+def read_fastx_chunks(path: str, chunk_size: int):
+    """Yield (reads, is_last) in chunks of chunk_size reads (whole file if chunk_size <= 0).
+
+    The next chunk is read ahead so the last one can be flagged.
+    """
+    records = read_fastx(path)
+    if chunk_size <= 0:
+        yield list(records), True
+        return
+    chunk = list(itertools.islice(records, chunk_size))
+    while True:
+        following = list(itertools.islice(records, chunk_size))
+        yield chunk, not following
+        if not following:
+            return
+        chunk = following
+
+
+def write_fastx(reads, path: str):
+    """Write (name, seq, qual) records as FASTQ, or FASTA when qualities are missing."""
+    with open(path, 'w') as f:
+        for name, seq, qual in reads:
+            if qual is None:
+                f.write(f'>{name}\n{seq}\n')
+            else:
+                f.write(f'@{name}\n{seq}\n+\n{qual}\n')
@@ -0,0 +1,74 @@
+import gzip
+import hashlib
+import os
+from datetime import datetime, timezone
+
+from flask import make_response, request
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+
+
+def files_version(paths, extra: str = ''):
+    """Weak ETag and Last-Modified for the current state of a set of files.
+
+    Missing files count as part of the state, so creating one changes the ETag.
+    """
+    digest = hashlib.sha1(extra.encode())
+    last_modified = 0
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            digest.update(f'{path}:-;'.encode())
+            continue
+        digest.update(f'{path}:{stat.st_mtime_ns}:{stat.st_size};'.encode())
+        last_modified = max(last_modified, stat.st_mtime)
+    return digest.hexdigest(), datetime.fromtimestamp(int(last_modified), timezone.utc)
+
+
+def conditional_response(paths, build, extra: str = ''):
+    """Answer 304 if the client already has the current version of paths, else build() the response.
+
+    extra distinguishes responses that depend on more than the files, such as
+    the query string.
+    """
+    etag, last_modified = files_version(paths, extra)
+    not_modified = False
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since is not None:
+        not_modified = last_modified <= request.if_modified_since
+    if not_modified:
+        response = make_response('', 304)
+    else:
+        response = make_response(build())
+    if response.status_code in (200, 304):
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        response.cache_control.no_cache = True
+    return response
+
+
+def compress_response(response):
+    """after_request hook: brotli- or gzip-encode large bodies when the client accepts it."""
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_SIZE:
+        return response
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(body))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
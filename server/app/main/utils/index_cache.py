@@ -0,0 +1,102 @@
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+from .fastx import read_fastx
+
+logger = logging.getLogger('nanocas')
+
+INDEX_CACHE_DIR = os.getenv('NANOCAS_INDEX_CACHE_DIR',
+                            os.path.join(os.path.expanduser('~'), '.nanocas', 'index_cache'))
+# Least recently used indexes are evicted once the cache grows past this many bytes
+INDEX_CACHE_BYTES = int(os.getenv('NANOCAS_INDEX_CACHE_BYTES', 20 * 1024 ** 3))
+INDEX_THREADS = int(os.getenv('NANOCAS_INDEX_THREADS', os.cpu_count() or 1))
+INDEX_PRESET = 'map-ont'
+
+_minimap2_version = None
+
+
+def minimap2_version() -> str:
+    global _minimap2_version
+    if _minimap2_version is None:
+        try:
+            _minimap2_version = subprocess.run(['minimap2', '--version'], capture_output=True,
+                                               text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            _minimap2_version = 'unknown'
+    return _minimap2_version
+
+
+def index_key(fasta_path: str, preset: str = INDEX_PRESET) -> str:
+    """Hash of the sequences in fasta_path and the index build parameters.
+
+    Sequences are normalized to their name (first word of the header) and
+    upper-case bases, so line wrapping and header comments don't matter.
+    """
+    digest = hashlib.sha256(f'{minimap2_version()}\t-x {preset}\n'.encode())
+    for name, seq, _ in read_fastx(fasta_path):
+        digest.update(f'>{name}\n'.encode())
+        digest.update(seq.upper().encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def evict(cache_dir: str = INDEX_CACHE_DIR, max_bytes: int = INDEX_CACHE_BYTES, keep: str = None):
+    """Remove least recently used indexes until the cache fits in max_bytes."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith('.mmi') and not name.startswith('tmp-') and path != keep:
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    if keep is not None and os.path.exists(keep):
+        total += os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        logger.debug(f"Evicted cached index {path}")
+
+
+def build_index(fasta_path: str, index_path: str, log_file=None, cache_dir: str = INDEX_CACHE_DIR,
+                threads: int = INDEX_THREADS) -> bool:
+    """Put a minimap2 index of fasta_path at index_path, reusing a cached build of the same sequences.
+
+    Cached indexes are hard-linked (or copied) into place, so evicting one
+    never breaks a project using it. Returns False if minimap2 failed.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    key = index_key(fasta_path)
+    cached = os.path.join(cache_dir, f'{key}.mmi')
+    # One build per key across processes; others wait and then reuse it
+    with open(os.path.join(cache_dir, f'{key}.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(cached):
+            logger.debug(f"Reusing cached index {cached}")
+            os.utime(cached)
+        else:
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=f'tmp-{key}-', suffix='.mmi')
+            os.close(fd)
+            cmd = ['minimap2', '-x', INDEX_PRESET, '-t', str(threads), '-d', tmp_path, fasta_path]
+            logger.debug(f"Building index: {' '.join(cmd)}")
+            try:
+                subprocess.run(cmd, check=True, stdout=log_file, stderr=log_file)
+            except (OSError, subprocess.CalledProcessError) as e:
+                logger.error(f"Minimap2 failed: {e}")
+                os.remove(tmp_path)
+                return False
+            os.replace(tmp_path, cached)
+            evict(cache_dir, keep=cached)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        try:
+            os.link(cached, index_path)
+        except OSError:
+            shutil.copyfile(cached, index_path)
+    return True
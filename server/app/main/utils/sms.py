@@ -1,4 +1,6 @@
 import os
+import time
+from threading import Condition, Lock, Thread
 from twilio.rest import Client
 from twilio.base.exceptions import TwilioRestException
 import logging
@@ -8,22 +10,162 @@ load_dotenv()
 
 logger = logging.getLogger('nanocas')
 
-def send_sms(body, recipient_phone):
-    account_sid = os.getenv('TWILIO_ACCOUNT_SID')
-    auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-    twilio_phone = os.getenv('TWILIO_PHONE_NUMBER')
+# Messages per second and burst allowed per sending number (Twilio long codes send 1 per second)
+SMS_RATE = float(os.getenv('NANOCAS_SMS_RATE', 1))
+SMS_BURST = int(os.getenv('NANOCAS_SMS_BURST', 1))
+# Seconds to wait for more alerts to the same recipient before sending them as one SMS
+SMS_COALESCE_WINDOW = float(os.getenv('NANOCAS_SMS_COALESCE_WINDOW', 2))
+# Retries follow the same settings as the notification dispatcher
+SMS_MAX_ATTEMPTS = int(os.getenv('NANOCAS_NOTIFY_ATTEMPTS', 4))
+SMS_RETRY_DELAY = float(os.getenv('NANOCAS_NOTIFY_RETRY_DELAY', 2.0))
+# Twilio rejects bodies longer than this
+MAX_SMS_LENGTH = 1600
+
+_transport = None
+_transport_lock = Lock()
+_outbox = None
+_outbox_lock = Lock()
+
+
+class TwilioTransport:
+    """Sends messages through one Twilio client; base_url points it at a fake API for tests and benchmarks."""
+
+    def __init__(self, account_sid: str, auth_token: str, from_number: str, base_url: str = None):
+        self.client = Client(account_sid, auth_token)
+        if base_url:
+            self.client.api.base_url = base_url
+        self.from_number = from_number
+
+    def send(self, recipient: str, body: str) -> str:
+        message = self.client.messages.create(body=body, from_=self.from_number, to=recipient)
+        return message.sid
+
+
+def get_transport():
+    """Process-wide transport built from the TWILIO_* settings, or None if they are missing."""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            account_sid = os.getenv('TWILIO_ACCOUNT_SID')
+            auth_token = os.getenv('TWILIO_AUTH_TOKEN')
+            twilio_phone = os.getenv('TWILIO_PHONE_NUMBER')
+            if all([account_sid, auth_token, twilio_phone]):
+                _transport = TwilioTransport(account_sid, auth_token, twilio_phone,
+                                             base_url=os.getenv('TWILIO_BASE_URL'))
+        return _transport
+
+
+def set_transport(transport):
+    """Replace the transport, e.g. with a fake; it needs a send(recipient, body) method."""
+    global _transport
+    with _transport_lock:
+        _transport = transport
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def reserve(self) -> float:
+        """Take a token, returning how many seconds to wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
 
-    if not all([account_sid, auth_token, twilio_phone, recipient_phone]):
+
+class SMSOutbox:
+    """Coalesces alerts per recipient and sends them on a background thread within the rate limit.
+
+    Messages to a recipient that arrive within the coalescing window of the
+    first one go out as a single SMS. Failed sends are retried with backoff.
+    """
+
+    def __init__(self, window: float = SMS_COALESCE_WINDOW, rate: float = SMS_RATE, burst: int = SMS_BURST,
+                 max_attempts: int = SMS_MAX_ATTEMPTS, retry_delay: float = SMS_RETRY_DELAY):
+        self.window = window
+        self.bucket = TokenBucket(rate, burst)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.pending = {}  # recipient -> {'bodies', 'due', 'attempt'}
+        self.cond = Condition()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, recipient: str, body: str):
+        with self.cond:
+            entry = self.pending.get(recipient)
+            if entry is None:
+                self.pending[recipient] = {'bodies': [body], 'due': time.monotonic() + self.window, 'attempt': 1}
+                self.cond.notify()
+            else:
+                entry['bodies'].append(body)
+
+    def _next_due(self):
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                due = [(entry['due'], recipient) for recipient, entry in self.pending.items()]
+                if due and min(due)[0] <= now:
+                    recipient = min(due)[1]
+                    return recipient, self.pending.pop(recipient)
+                self.cond.wait(min(due)[0] - now if due else None)
+
+    def _run(self):
+        while True:
+            recipient, entry = self._next_due()
+            body = "\n".join(entry['bodies'])
+            if len(body) > MAX_SMS_LENGTH:
+                body = body[:MAX_SMS_LENGTH - 3] + "..."
+            time.sleep(self.bucket.reserve())
+            if self._send(recipient, body):
+                continue
+            if entry['attempt'] >= self.max_attempts:
+                logger.error(f"Giving up on SMS to {recipient} after {entry['attempt']} attempts")
+                continue
+            with self.cond:
+                # Alerts that arrived meanwhile go out with the retry
+                newer = self.pending.pop(recipient, {'bodies': []})
+                self.pending[recipient] = {
+                    'bodies': entry['bodies'] + newer['bodies'],
+                    'due': time.monotonic() + self.retry_delay * 2 ** (entry['attempt'] - 1),
+                    'attempt': entry['attempt'] + 1
+                }
+
+    def _send(self, recipient: str, body: str) -> bool:
+        transport = get_transport()
+        if transport is None:
+            logger.error("Twilio configuration missing. SMS not sent.")
+            return True
+        try:
+            sid = transport.send(recipient, body)
+            logger.info(f"SMS sent successfully: {sid}")
+            return True
+        except TwilioRestException as e:
+            logger.error(f"Failed to send SMS: {e}")
+        except Exception as e:
+            logger.error(f"Failed to send SMS to {recipient}: {e}")
+        return False
+
+
+def get_outbox() -> SMSOutbox:
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = SMSOutbox()
+        return _outbox
+
+
+def send_sms(body, recipient_phone):
+    """Queue body for recipient_phone; alerts close together are sent as one rate-limited SMS."""
+    if not recipient_phone or get_transport() is None:
         logger.error("Twilio configuration or recipient phone missing. SMS not sent.")
-        return
-
-    try:
-        client = Client(account_sid, auth_token)
-        message = client.messages.create(
-            body=body,
-            from_=twilio_phone,
-            to=recipient_phone
-        )
-        logger.info(f"SMS sent successfully: {message.sid}")
-    except TwilioRestException as e:
-        logger.error(f"Failed to send SMS: {e}")
\ No newline at end of file
+        return None
+    get_outbox().add(recipient_phone, body)
+    return True
@@ -1,8 +1,14 @@
 import os
-from celery import Celery
 import subprocess, os, shutil, datetime
 import json, sys
 import logging
+import tempfile
+import pysam
+from .CoverageAccumulator import CoverageAccumulator
+from .CoverageTimeline import CoverageTimeline
+from .ResidentAligner import ResidentAligner
+from .fastx import write_fastx
+from .index_cache import build_index
 
 redis_host = os.getenv('REDIS_HOST', 'localhost')
 redis_port = os.getenv('REDIS_PORT', '6379')
@@ -18,11 +24,20 @@ if not logger.handlers:  # Prevent duplicate handlers
     logger.addHandler(handler)
     logger.setLevel(logging.DEBUG)
 
-celery = Celery('tasks', broker=broker_url, backend='redis')
+# Celery is only needed with the celery executor; local-only installs run the jobs below without it
+try:
+    from celery import Celery
+except ImportError:
+    celery = None
+else:
+    celery = Celery('tasks', broker=broker_url, backend='redis')
 
-@celery.task(bind=True, name='app.main.tasks.int_download_database')
-def int_download_database(self, db_data, nanocas_location, queries):
-    """Download and build a database from query sequences using Minimap2."""
+def download_database_job(progress, db_data, nanocas_location, queries):
+    """Download and build a database from query sequences using Minimap2.
+
+    progress(meta) reports PROGRESS state with a meta dict, whichever
+    executor runs the job.
+    """
     # Extract task parameters
     minion = db_data['minion']
     project_id = db_data['projectId']
@@ -62,14 +77,11 @@ def int_download_database(self, db_data, nanocas_location, queries):
 
             # Update task progress
             percent_done = int((i + 1) / len(queries) * 50)
-            self.update_state(
-                state="PROGRESS",
-                meta={
-                    'percent-done': percent_done,
-                    'message': f"Processed query {i+1}/{len(queries)}",
-                    'project_id': project_id
-                }
-            )
+            progress({
+                'percent-done': percent_done,
+                'message': f"Processed query {i+1}/{len(queries)}",
+                'project_id': project_id
+            })
             logger.debug(f"Progress: {percent_done}% done for project {project_id}")
 
         # Set device and save alertinfo configuration
@@ -82,37 +94,85 @@ def int_download_database(self, db_data, nanocas_location, queries):
             pass
         logger.debug("No queries provided, created empty input file.")
 
-    # Build the database index
-    self.update_state(
-        state="PROGRESS",
-        meta={'percent-done': 98, 'message': "Building the index.", 'project_id': project_id}
-    )
+    # Build the database index, or reuse one built earlier for the same sequences
+    progress({'percent-done': 98, 'message': "Building the index.", 'project_id': project_id})
     logger.debug("Building the index with Minimap2")
-    index_cmd = f"minimap2 -x map-ont -d {db_index_path} {input_sequences_path}"
     build_log_path = os.path.join(database_dir, 'building_index.txt')
     with open(build_log_path, 'w') as f:
-        try:
-            subprocess.run(index_cmd, shell=True, check=True, stdout=f, stderr=f)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Minimap2 failed: {e}")
+        if not build_index(input_sequences_path, db_index_path, log_file=f):
             return "ER1"
         
-    # Create coverage.csv with header as soon as MMI file is generated
-    coverage_file = os.path.join(nanocas_location, 'coverage.csv')
-    with open(coverage_file, 'w') as f:
-        f.write("timestamp,reference,depth,breadth,read_count\n")
+    # Create the coverage timeline as soon as MMI file is generated
+    CoverageTimeline.open(nanocas_location).close()
 
     # Mark task as complete
-    self.update_state(
-        state="PROGRESS",
-        meta={
-            'percent-done': 100,
-            'message': "Database successfully downloaded and built.",
-            'nanocas_location': nanocas_location,
-            'minion': minion,
-            'device': device,
-            'project_id': project_id
-        }
-    )
+    progress({
+        'percent-done': 100,
+        'message': "Database successfully downloaded and built.",
+        'nanocas_location': nanocas_location,
+        'minion': minion,
+        'device': device,
+        'project_id': project_id
+    })
     logger.debug("Database build completed successfully")
-    return {"minion": minion, "nanocas_location": nanocas_location, "device": device}
\ No newline at end of file
+    return {"minion": minion, "nanocas_location": nanocas_location, "device": device}
+
+
+# Resident aligners of this worker process, by index file
+_aligners = {}
+
+
+def get_worker_aligner(index_file):
+    """Aligner with index_file loaded, kept for later batches; None if mappy is unavailable."""
+    if not ResidentAligner.available():
+        return None
+    if index_file not in _aligners:
+        _aligners.clear()
+        _aligners[index_file] = ResidentAligner(index_file)
+    return _aligners[index_file]
+
+
+def align_batch_job(progress, index_file, reads, output_bam, quality_threshold=15):
+    """Align a batch of (name, seq, qual) reads and return its coverage delta.
+
+    The sorted BAM is written to output_bam when that directory is visible
+    from this worker (shared project storage), so the backend can keep it.
+    """
+    keep_bam = os.path.isdir(os.path.dirname(output_bam))
+    fd, bam_path = tempfile.mkstemp(suffix='.bam', dir=os.path.dirname(output_bam) if keep_bam else None)
+    os.close(fd)
+    try:
+        aligner = get_worker_aligner(index_file)
+        if aligner is not None:
+            aligner.align_reads(reads, bam_path)
+        else:
+            chunk_fastq = bam_path + '.fastq'
+            write_fastx(reads, chunk_fastq)
+            try:
+                cmd = f'minimap2 -a {index_file} {chunk_fastq} | samtools view -b | samtools sort -o {bam_path}'
+                subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            finally:
+                os.remove(chunk_fastq)
+        pysam.quickcheck(bam_path)
+        accumulator = CoverageAccumulator(quality_threshold)
+        accumulator.add_bam(bam_path)
+        if keep_bam:
+            os.replace(bam_path, output_bam)
+    finally:
+        if os.path.exists(bam_path):
+            os.remove(bam_path)
+    logger.debug(f"Aligned {len(reads)} reads into a coverage delta for {output_bam}")
+    return {'delta': accumulator.to_delta(), 'bam': output_bam if keep_bam else None, 'reads': len(reads)}
+
+
+# Celery entry points for the jobs above; executor.py runs the same jobs without a broker
+if celery is not None:
+    @celery.task(bind=True, name='app.main.tasks.int_download_database')
+    def int_download_database(self, db_data, nanocas_location, queries):
+        return download_database_job(lambda meta: self.update_state(state="PROGRESS", meta=meta),
+                                     db_data, nanocas_location, queries)
+
+    @celery.task(bind=True, name='app.main.tasks.align_batch', acks_late=True)
+    def align_batch(self, index_file, reads, output_bam, quality_threshold=15):
+        return align_batch_job(lambda meta: self.update_state(state="PROGRESS", meta=meta),
+                               index_file, reads, output_bam, quality_threshold)
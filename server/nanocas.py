@@ -1,8 +1,21 @@
 # FILE: ./nanocas.py
 # The main entry point in the application
 
-from dotenv import load_dotenv
 import os
+
+# development: Flask debug server with a thread per client. production: eventlet (or gevent) server
+SERVER_MODE = os.getenv('NANOCAS_SERVER_MODE', 'development')
+ASYNC_MODE = os.environ.setdefault('NANOCAS_ASYNC_MODE', 'eventlet' if SERVER_MODE == 'production' else 'threading')
+
+# Patch before anything imports socket. threading stays native so the pipeline's threads run in parallel
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch(thread=False)
+elif ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all(thread=False)
+
+from dotenv import load_dotenv
 import logging
 import sys
 from app import create_app, socketio
@@ -23,8 +36,11 @@ if not logger.handlers:  # Prevent duplicate handlers
 # logging.config.fileConfig("./server/logging.ini")
 # log = logging.getLogger('nanocas')
 
-app = create_app(debug=True)
+app = create_app(debug=SERVER_MODE != 'production')
 
 if __name__ == '__main__':
+    from app.main.utils import concurrency
+    concurrency.start()
     port = int(os.getenv('BACKEND_PORT', 5007))  # Already uses env variable
+    logger.debug(f"Starting the {SERVER_MODE} server ({ASYNC_MODE}) on port {port}")
     socketio.run(app, host='0.0.0.0', port=port)
\ No newline at end of file
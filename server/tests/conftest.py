@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the server as the app package, as nanocas.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+    return create_app()
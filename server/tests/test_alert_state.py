@@ -0,0 +1,76 @@
+import json
+import os
+import random
+import time
+
+import mappy
+import pytest
+
+from app.main.utils.AlertState import AlertState
+
+REF_LENGTH = 2000
+READ_LENGTH = 200
+
+
+@pytest.fixture
+def fastq_project(tmp_path):
+    rng = random.Random(0)
+    reference = ''.join(rng.choice('ACGT') for _ in range(REF_LENGTH))
+    project_dir = tmp_path / 'project'
+    minion_dir = tmp_path / 'minion'
+    (project_dir / 'database').mkdir(parents=True)
+    (project_dir / 'minimap2' / 'runs').mkdir(parents=True)
+    minion_dir.mkdir()
+    fasta_path = project_dir / 'database' / 'db.fa'
+    fasta_path.write_text(f'>ref0\n{reference}\n')
+    mappy.Aligner(str(fasta_path), preset='map-ont', fn_idx_out=str(project_dir / 'database' / 'db.mmi'))
+    fasta_path.unlink()
+    with open(project_dir / 'alertinfo.cfg', 'w') as f:
+        json.dump({'projectId': 'alert-test', 'fileType': 'FASTQ',
+                   'queries': [{'name': 'Ref0', 'header': 'ref0', 'threshold': '2'}],
+                   'device': '', 'alertNotifConfig': {}}, f)
+    # 30 reads of 0.1x each, so depth passes 2x partway through the file
+    with open(minion_dir / 'reads.fastq', 'w') as f:
+        for i in range(30):
+            start = rng.randrange(REF_LENGTH - READ_LENGTH)
+            seq = reference[start:start + READ_LENGTH]
+            f.write(f'@r{i}\n{seq}\n+\n{"I" * READ_LENGTH}\n')
+    return str(project_dir) + os.sep, str(minion_dir)
+
+
+@pytest.mark.parametrize('run', range(5))
+def test_streamed_chunks_alert_once(app, fastq_project, monkeypatch, run):
+    from app.main.utils import FileHandler as file_handler
+
+    monkeypatch.setattr(file_handler, 'CHUNK_READS', 5)
+    project_dir, minion_dir = fastq_project
+    fh = file_handler.FileHandler(project_dir)
+    alerts = []
+    fh.dispatch_alert = alerts.append
+    try:
+        fh.process_existing_files(minion_dir)
+        deadline = time.monotonic() + 60
+        while len(fh.ledger) < 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        fh.close()
+    assert fh.coverage.read_counts['ref0'] == 30
+    assert len(alerts) == 1
+
+
+def test_lower_depth_does_not_rearm(tmp_path):
+    state = AlertState(str(tmp_path / 'alert_state.json'))
+    query = {'name': 'Ref0', 'threshold': '2'}
+    assert state.evaluate('ref0', query, 2.5) == 0
+    # A caller that has not caught up with the worker that fired
+    assert state.evaluate('ref0', query, 1.5) is None
+    assert state.evaluate('ref0', query, 3.0) is None
+
+
+def test_changed_threshold_rearms(tmp_path):
+    state = AlertState(str(tmp_path / 'alert_state.json'))
+    assert state.evaluate('ref0', {'name': 'Ref0', 'threshold': '2'}, 2.5) == 0
+    raised = {'name': 'Ref0', 'threshold': '4'}
+    assert state.evaluate('ref0', raised, 2.5) is None
+    assert state.evaluate('ref0', raised, 4.5) == 0
+    assert AlertState(state.path).evaluate('ref0', raised, 5.0) is None
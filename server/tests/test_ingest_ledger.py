@@ -0,0 +1,136 @@
+import json
+import os
+import time
+
+import pysam
+import pytest
+
+# An empty BGZF block, as written at the end of every BAM
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def write_bam(path, reads=5, name='r'):
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'}, 'SQ': [{'SN': 'ref0', 'LN': 1000}]}
+    with pysam.AlignmentFile(path, 'wb', header=header) as bam:
+        for i in range(reads):
+            read = pysam.AlignedSegment(bam.header)
+            read.query_name = f'{name}{i}'
+            read.query_sequence = 'A' * 100
+            read.query_qualities = pysam.qualitystring_to_array('I' * 100)
+            read.reference_id = 0
+            read.reference_start = i * 100
+            read.mapping_quality = 60
+            read.cigarstring = '100M'
+            bam.write(read)
+
+
+@pytest.fixture
+def bam_project(tmp_path):
+    project_dir = tmp_path / 'project'
+    minion_dir = tmp_path / 'minion'
+    project_dir.mkdir()
+    minion_dir.mkdir()
+    with open(project_dir / 'alertinfo.cfg', 'w') as f:
+        json.dump({'projectId': 'ledger-test', 'fileType': 'BAM',
+                   'queries': [{'name': 'Ref0', 'header': 'ref0', 'threshold': '1000'}],
+                   'device': '', 'alertNotifConfig': {}}, f)
+    bam_path = str(minion_dir / 'reads.bam')
+    write_bam(bam_path)
+    return str(project_dir) + os.sep, str(minion_dir), bam_path
+
+
+def wait_for_ledger(fh, count, timeout=30):
+    deadline = time.monotonic() + timeout
+    while len(fh.ledger) < count and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert len(fh.ledger) == count
+
+
+def test_appended_file_is_not_ingested_again(app, bam_project, caplog):
+    from app.main.utils.FileHandler import FileHandler
+
+    project_dir, minion_dir, bam_path = bam_project
+    fh = FileHandler(project_dir)
+    try:
+        fh.process_existing_files(minion_dir)
+        wait_for_ledger(fh, 1)
+        assert fh.coverage.read_counts['ref0'] == 5
+
+        # Appending changes the file's key but keeps its start
+        os.utime(bam_path)
+        with open(bam_path, 'ab') as f:
+            f.write(BGZF_EOF)
+        assert not fh.accepts(bam_path)
+        assert 'after it was processed' in caplog.text
+        fh.submit_file(bam_path)
+        assert len(fh.ledger) == 1
+    finally:
+        fh.close()
+    assert fh.coverage.read_counts['ref0'] == 5
+
+
+@pytest.mark.parametrize('reads', [3, 8])
+def test_rewritten_file_is_ingested_again(app, bam_project, tmp_path, reads):
+    from app.main.utils.FileHandler import FileHandler
+
+    project_dir, minion_dir, bam_path = bam_project
+    fh = FileHandler(project_dir)
+    try:
+        fh.process_existing_files(minion_dir)
+        wait_for_ledger(fh, 1)
+        assert fh.coverage.read_counts['ref0'] == 5
+
+        # Truncate and rewrite in place, keeping the inode: smaller with 3 reads, larger with 8
+        replacement = str(tmp_path / 'replacement.bam')
+        write_bam(replacement, reads, name='s')
+        inode = os.stat(bam_path).st_ino
+        with open(bam_path, 'r+b') as f, open(replacement, 'rb') as src:
+            f.truncate(0)
+            f.write(src.read())
+        assert os.stat(bam_path).st_ino == inode
+        assert fh.accepts(bam_path)
+        fh.submit_file(bam_path)
+        wait_for_ledger(fh, 2)
+    finally:
+        fh.close()
+    assert fh.coverage.read_counts['ref0'] == 5 + reads
+
+
+def test_ledger_follows_moves_and_forgets_deleted_files(tmp_path):
+    from app.main.utils.IngestLedger import IngestLedger
+
+    path = str(tmp_path / 'a.bam')
+    moved = str(tmp_path / 'b.bam')
+    write_bam(path)
+    ledger = IngestLedger.open(str(tmp_path))
+    try:
+        ledger.add(os.stat(path), path)
+        os.rename(path, moved)
+        ledger.move(path, moved)
+        assert ledger.seen(moved, os.stat(moved))
+
+        ledger.forget(moved)
+        assert not ledger.seen(moved, os.stat(moved))
+        assert len(ledger) == 0
+    finally:
+        ledger.close()
+
+
+def test_truncate_drops_files_added_after_a_forgotten_one(tmp_path):
+    from app.main.utils.IngestLedger import IngestLedger
+
+    paths = [str(tmp_path / f'{name}.bam') for name in 'abcd']
+    for path in paths:
+        write_bam(path, name=os.path.basename(path))
+    ledger = IngestLedger.open(str(tmp_path))
+    try:
+        for path in paths[:3]:
+            ledger.add(os.stat(path), path)
+        checkpoint_seq = ledger.flush()
+        # The newest entry is deleted, then another file is processed before a crash
+        ledger.forget(paths[2])
+        ledger.add(os.stat(paths[3]), paths[3])
+        assert ledger.truncate(checkpoint_seq) == 1
+        assert not ledger.seen(paths[3], os.stat(paths[3]))
+    finally:
+        ledger.close()